@@ -1,7 +1,15 @@
 #!/usr/bin/env bash
 
-for name in buffer case1-a case2-a case3 incomplete-columns overlap mreads-case1 \
-        mreads-case2 mreads-case3 mreads-case4 mreads-case5 Notations
+# usage: export_svg_files.sh [name ...] (default: all the figures)
+
+names="$@"
+if [ -z "${names}" ]
+then
+  names="buffer case1-a case2-a case3 incomplete-columns overlap mreads-case1 \
+        mreads-case2 mreads-case3 mreads-case4 mreads-case5 Notations"
+fi
+
+for name in ${names}
 do
   #echo "Exporting ${name}.svg"
   inkscape -D -z --file=$PWD/figures/svg/${name}.svg --export-pdf=$PWD/figures/svg/${name}.pdf --export-latex
@@ -3,11 +3,7 @@
 set -e
 set -u
 
-scripts/experiment/generate_avg_var_data.py
-scripts/experiment/generate_total_avg_var_data.py # for total merge time figure
-figures/svg/export_svg_files.sh
-scripts/model/model.gnplt &> data/seeks-model.dat
-scripts/experiment/number_of_seeks.gnuplot # don't run this before the model as the model generates data to plot
-scripts/experiment/split_and_merge_total_time.gnuplot
-scripts/experiment/compare_breakdown_errbar.gnuplot
-
+# Rebuilds the stale figures only, independent ones in parallel (see scripts/build_figures.py).
+# Arguments are passed on, e.g. ./generate_figures.sh svg/buffer to export a single SVG figure,
+# ./generate_figures.sh -f to rebuild everything, ./generate_figures.sh -l to list the targets.
+scripts/build_figures.py "$@"
@@ -0,0 +1,79 @@
+import numpy as np
+import struct
+import zlib
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from time import time
+
+# Block-parallel gzip output, in the spirit of BGZF and pigz: the data is cut
+# into members that are compressed independently by a pool of threads, and
+# written in order. A file made of several gzip members is a valid gzip
+# file, readable by gzip, Python's gzip module and nibabel.
+
+# gzip member header: magic, deflate, no flags, no mtime, no extra flags, unknown OS
+member_header = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def compress_member(data, compresslevel):
+    """Return data compressed as a complete gzip member."""
+    # zlib releases the GIL while compressing, so members compress in parallel
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+    return member_header + deflated + trailer
+
+
+class BlockGzipWriter(object):
+    """Write-only file object compressing its data as independent gzip members.
+
+    Writes are cut into members of at most member_bytes bytes, compressed by
+    a pool of threads while the caller keeps producing data. At most
+    2 * threads members wait for compression; write() blocks beyond that.
+    Members are copies of the data, which can therefore be modified or
+    released once write() returns: the writer holds at most
+    2 * threads * member_bytes bytes of it.
+
+    compress_time is the time write() and close() spent waiting for
+    compressed members, and pending_bytes the bytes of the members waiting.
+    """
+
+    def __init__(self, fileobj, threads=4, member_bytes=16*1024**2, compresslevel=6):
+        self.fileobj = fileobj
+        self.threads = threads
+        self.member_bytes = member_bytes
+        self.compresslevel = compresslevel
+        self.pool = ThreadPool(threads)
+        self.pending = deque()
+        self.pending_bytes = 0
+        self.compress_time = 0
+
+    def write(self, data):
+        view = np.frombuffer(data, dtype=np.uint8)
+        for start in range(0, len(view), self.member_bytes):
+            # a copy, so as not to keep the caller's buffer alive while the member waits
+            member = view[start:start + self.member_bytes].tobytes()
+            self.pending.append((self.pool.apply_async(compress_member, (member, self.compresslevel)), len(member)))
+            self.pending_bytes += len(member)
+            while len(self.pending) > 2 * self.threads:
+                self._write_member()
+
+    def _write_member(self):
+        t = time()
+        result, length = self.pending.popleft()
+        member = result.get()
+        self.compress_time += time() - t
+        self.pending_bytes -= length
+        self.fileobj.write(member)
+
+    def close(self):
+        while self.pending:
+            self._write_member()
+        self.pool.close()
+        self.pool.join()
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,180 @@
+import nibabel as nib
+import os
+import numpy as np
+import argparse
+from multiprocessing import Pool
+
+# The block index stores, for every block of a legend, where the block goes
+# in the reconstructed image. It is built once from the block headers and
+# saved next to the legend, as <legend>.index.npz.
+#
+# Two kinds of legends are supported: legend images, whose voxels are the
+# block numbers of reconstruct_bb.py, and the legend.txt files of imageutils,
+# which list one block file per line, named after the block position
+# (e.g. bigbrain_770_605_0.nii). Sparse splits (generate_dataset.py --sparse)
+# do not write the blocks whose voxels are all zero, and list them as
+# <block file> zero <ydim> <zdim> <xdim> <dtype> instead.
+
+
+def legend_blocks(legend):
+    """Return the block numbers of a legend image in x, y, z order, without repeats."""
+    # x is the outer loop and z the inner loop of the walk
+    walk = np.asarray(legend).transpose(2, 0, 1).ravel().astype(np.int64)
+    block_nums, first = np.unique(walk, return_index=True)
+    return block_nums[np.argsort(first)]
+
+
+def block_filename(block_folder, block_prefix, block_num, block_suffix):
+    return '{0}-0{1}-{2}'.format(os.path.join(block_folder,block_prefix), str(int(block_num)).zfill(3), block_suffix)
+
+
+def block_start(header):
+    """Return the world start and step of a block, as (ystart, zstart, xstart), (ystep, zstep, xstep)."""
+    start = header['descrip'].tostring().strip('\x00').split()
+    step = header['pixdim']
+
+    ystep = round(float(step[1]), 2)
+    zstep = round(float(step[2]), 2)
+    xstep = round(float(step[3]), 2)
+
+    ystart = float(start[0].strip())
+    zstart = float(start[1].strip())
+    xstart = float(start[2].strip())
+
+    return (ystart, zstart, xstart), (ystep, zstep, xstep)
+
+
+def read_text_legend(legend_fn):
+    with open(legend_fn) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def zero_block_entry(line):
+    """Return the shape and dtype of a zero block line of a text legend, or None for a block file."""
+    fields = line.split()
+    if len(fields) == 6 and fields[1] == 'zero':
+        return tuple(int(d) for d in fields[2:5]), fields[5]
+    return None
+
+
+def text_legend_position(block_filename):
+    """Return the (y, z, x) position at the end of a block file name, e.g. bigbrain_770_605_0.nii."""
+    name = os.path.basename(block_filename).split('.')[0]
+    return tuple(int(p) for p in name.split('_')[-3:])
+
+
+def read_block_header(block_filename):
+    block_img = nib.load(block_filename)
+    header = block_img.header
+    try:
+        start, step = block_start(header)
+    except (IndexError, ValueError):
+        # blocks listed in text legends have no start in their description
+        start, step = (0, 0, 0), (1, 1, 1)
+    return start, step, header.get_data_shape()[:3], block_img.dataobj.offset, header.get_data_dtype().str
+
+
+def index_filename(legend_fn):
+    return legend_fn + '.index.npz'
+
+
+def build_block_index(legend_fn, block_folder, block_prefix, block_suffix, jobs=None):
+    """Read the headers of all the blocks of a legend and return the block index.
+
+    block_folder, block_prefix and block_suffix are ignored for text legends.
+    The headers are read by a pool of jobs processes (default: one per CPU).
+    The index is a dict of arrays with one row per block, sorted by offset in
+    the reconstructed image:
+      block_id    -- block number in the legend
+      position    -- (y, z, x) voxel position of the block in the reconstructed image
+      shape       -- (y, z, x) shape of the block
+      path        -- block file name
+      data_offset -- offset of the voxel data in the (uncompressed) block file
+      dtype       -- numpy dtype string of the voxel data
+      zero        -- whether the block is all zeros and has no file (sparse splits)
+    """
+    zero_entries = {}
+    if legend_fn.endswith('.txt'):
+        paths = read_text_legend(legend_fn)
+        for i, line in enumerate(paths):
+            entry = zero_block_entry(line)
+            if entry:
+                paths[i] = line.split()[0]
+                zero_entries[i] = entry
+        block_ids = np.arange(1, len(paths) + 1)
+    else:
+        legend = nib.load(legend_fn).get_data()
+        block_ids = legend_blocks(legend)
+        paths = [block_filename(block_folder, block_prefix, block_id, block_suffix) for block_id in block_ids]
+
+    pool = Pool(jobs)
+    try:
+        headers = pool.map(read_block_header, [path for i, path in enumerate(paths) if i not in zero_entries])
+    finally:
+        pool.close()
+        pool.join()
+    # zero blocks have no header: their shape and dtype are in the legend
+    for i in sorted(zero_entries):
+        shape, dtype = zero_entries[i]
+        headers.insert(i, ((0, 0, 0), (1, 1, 1), shape, 0, np.dtype(dtype).str))
+
+    if legend_fn.endswith('.txt'):
+        position = np.array([text_legend_position(path) for path in paths], dtype=np.int64)
+    else:
+        starts = np.array([h[0] for h in headers], dtype=np.float64)
+        steps = np.array([h[1] for h in headers], dtype=np.float64)
+
+        # positions are relative to the first block of the legend walk, and rounded
+        # because decimal starts and steps (e.g. 0.04) are not exact in floating point
+        position = np.rint(np.abs((starts - starts[0]) / steps)).astype(np.int64)
+    order = np.lexsort((position[:, 0], position[:, 1], position[:, 2]))
+
+    return {
+        'block_id': block_ids[order],
+        'position': position[order],
+        'shape': np.array([h[2] for h in headers], dtype=np.int64)[order],
+        'path': np.array(paths)[order],
+        'data_offset': np.array([h[3] for h in headers], dtype=np.int64)[order],
+        'dtype': np.array([h[4] for h in headers])[order],
+        'zero': np.array([i in zero_entries for i in range(0, len(paths))], dtype=bool)[order]
+    }
+
+
+def load_block_index(legend_fn, block_folder, block_prefix, block_suffix, jobs=None):
+    """Return the block index of a legend, building and saving it if needed.
+
+    The saved index is reused unless the legend is newer, the block naming
+    differs from the one it was built with, or it predates zero blocks.
+    """
+    index_fn = index_filename(legend_fn)
+    naming = np.array([block_folder, block_prefix, block_suffix])
+
+    if os.path.exists(index_fn) and os.path.getmtime(index_fn) >= os.path.getmtime(legend_fn):
+        saved = np.load(index_fn)
+        if np.array_equal(saved['naming'], naming) and 'zero' in saved.files:
+            return dict((k, saved[k]) for k in saved.files if k != 'naming')
+
+    index = build_block_index(legend_fn, block_folder, block_prefix, block_suffix, jobs)
+    # np.savez appends .npz to names that do not end with it
+    np.savez(index_fn, naming=naming, **index)
+    return index
+
+
+if __name__ == "__main__":
+
+    # sample command: python block_index.py legend1000_1.mnc /data/nifti-blocks/ block40 inv.nii.gz
+
+    parser = argparse.ArgumentParser(description='Build the block index of a legend image')
+    parser.add_argument('legend', type=str, help='The legend image to be used for reconstruction')
+    parser.add_argument('blockfldr', type=str, help="The folder containing the blocks")
+    parser.add_argument('blockprfx', type=str, help="The block name prefix. ex: block-0001-inv.nii, prefix = block")
+    parser.add_argument('blocksffx', type=str, help="The block name suffix. ex: block-0001-inv.nii, suffix = inv.nii")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="Number of processes reading block headers (default: one per CPU)")
+
+    args = parser.parse_args()
+
+    index = build_block_index(args.legend, args.blockfldr, args.blockprfx, args.blocksffx, args.jobs)
+    np.savez(index_filename(args.legend), naming=np.array([args.blockfldr, args.blockprfx, args.blocksffx]),
+             **index)
+    print('{0} blocks indexed in {1}'.format(len(index['block_id']), index_filename(args.legend)))
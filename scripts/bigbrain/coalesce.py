@@ -0,0 +1,79 @@
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disk-benchmarks'))
+import calibrate
+
+# Seek-aware coalescing of the writes of a flush. Between two ranges of
+# contiguous bytes to be written, the writer either seeks over the gap, or
+# fills the gap and writes both ranges and the gap at once. With a device
+# profile (see calibrate.py), the planner fills a gap when that is
+# predicted to be faster than the seek:
+#   - with zeros, on a fresh (zero-filled) image, when no byte of the gap
+#     was written yet: the cost is that of writing the gap;
+#   - otherwise with the bytes of the gap read from the image (read, modify,
+#     write): the gaps of a run of ranges are read at once, with the ranges
+#     between them, so that the cost is that of reading the gap and the range
+#     before it, and of writing the gap.
+# The bytes filled or read by a flush are bounded, since they are held in
+# memory.
+
+
+def merge_intervals(starts, ends):
+    """Return the union of the intervals [starts, ends), as sorted disjoint intervals."""
+    if not len(starts):
+        return starts, ends
+    order = np.argsort(starts, kind='mergesort')
+    starts, ends = starts[order], np.maximum.accumulate(ends[order])
+    # an interval starts a new union where it begins after all the previous ones end
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > ends[:-1]
+    first = np.flatnonzero(new)
+    return starts[first], np.concatenate([ends[first[1:] - 1], ends[-1:]])
+
+
+def overlapping(starts, ends, union_starts, union_ends):
+    """Return whether each interval [starts, ends) overlaps an interval of a sorted disjoint union."""
+    if not len(union_starts):
+        return np.zeros(len(starts), dtype=bool)
+    i = np.searchsorted(union_starts, ends, side='left') - 1
+    return (i >= 0) & (union_ends[np.maximum(i, 0)] > starts)
+
+
+class WritePlanner(object):
+    """Decide, for each gap between the ranges of a flush, whether to seek over it or to fill it."""
+
+    def __init__(self, profile, fresh=False, max_fill_bytes=64*1024**2):
+        self.profile = profile
+        self.fresh = fresh
+        self.max_fill_bytes = max_fill_bytes
+        # on a fresh image, the ranges written so far
+        self.written_starts = np.zeros(0, dtype=np.int64)
+        self.written_ends = np.zeros(0, dtype=np.int64)
+        # streaming throughputs, as the filled gaps are part of larger reads and writes
+        largest = max(profile['throughput']['request_bytes'])
+        self.read_throughput = float(calibrate.throughput(profile, largest, 'read'))
+        self.write_throughput = float(calibrate.throughput(profile, largest, 'write'))
+
+    def plan(self, starts, ends):
+        """Return, for each gap between the sorted disjoint ranges [starts, ends), whether to fill it, and
+        whether with zeros."""
+        gaps = starts[1:] - ends[:-1]
+        zero = np.zeros(len(gaps), dtype=bool)
+        if self.fresh:
+            zero = ~overlapping(ends[:-1], starts[1:], self.written_starts, self.written_ends)
+
+        # bytes read to fill a gap: the gap and the range before it
+        read_bytes = gaps + ends[:-1] - starts[:-1]
+        seek_cost = calibrate.seek_time(self.profile, gaps)
+        fill = gaps / self.write_throughput + np.where(zero, 0, read_bytes / self.read_throughput) < seek_cost
+
+        fill &= np.cumsum(np.where(fill, np.where(zero, gaps, read_bytes), 0)) <= self.max_fill_bytes
+        return fill, zero & fill
+
+    def written(self, starts, ends):
+        """Record ranges written to a fresh image."""
+        if self.fresh:
+            self.written_starts, self.written_ends = merge_intervals(
+                np.concatenate([self.written_starts, starts]), np.concatenate([self.written_ends, ends]))
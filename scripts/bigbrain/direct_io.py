@@ -0,0 +1,239 @@
+import numpy as np
+import ctypes
+import ctypes.util
+import io
+import mmap
+import os
+
+# Writes that bypass the page cache, so that a reconstruction neither evicts
+# the cached data of other jobs nor leaves the image cached for a following
+# benchmark repetition.
+#
+# Files are opened with O_DIRECT where the OS and the file system support it
+# (Linux, but not e.g. tmpfs). O_DIRECT transfers whole aligned pages from
+# aligned memory, so data goes through aligned buffers. Elsewhere, files are
+# written normally and the written pages are dropped from the page cache.
+
+# O_DIRECT offsets, sizes and buffers are aligned on the logical block size
+# of the device, 512 or 4096 bytes
+alignment = 4096
+
+
+def align_down(offset):
+    return offset // alignment * alignment
+
+
+def align_up(offset):
+    return -(-offset // alignment) * alignment
+
+
+def aligned_buffer(nbytes):
+    """Return a zeroed uint8 array of nbytes rounded up to the alignment, starting on a page boundary."""
+    # anonymous memory maps are page-aligned
+    return np.frombuffer(mmap.mmap(-1, align_up(max(nbytes, 1))), dtype=np.uint8)
+
+
+def open_direct(path, flags, mode=0o644):
+    """Open path with O_DIRECT if possible.
+
+    Returns the file descriptor, and whether it was opened with O_DIRECT.
+    """
+    if hasattr(os, 'O_DIRECT'):
+        try:
+            return os.open(path, flags | os.O_DIRECT, mode), True
+        except OSError:
+            # EINVAL: the file system does not support O_DIRECT
+            pass
+    return os.open(path, flags, mode), False
+
+
+# os.posix_fadvise is only available from Python 3.3, and madvise from 3.8:
+# elsewhere they are called from the C library, as is fallocate.
+# fallocate flags of linux/falloc.h: deallocate a range, keeping the file size
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+# advice of posix_fadvise and madvise on Linux
+POSIX_FADV_DONTNEED = 4
+MADV_DONTNEED = 4
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:
+    libc = None
+
+
+def libc_function(name, argtypes):
+    try:
+        function = getattr(libc, name)
+    except (AttributeError, TypeError):
+        # not Linux, or no C library
+        return None
+    function.argtypes = argtypes
+    return function
+
+
+fallocate = libc_function('fallocate64', [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64])
+posix_fadvise = libc_function('posix_fadvise64', [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int])
+madvise = libc_function('madvise', [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int])
+
+
+def fadvise_dontneed(fd):
+    """Drop the clean pages of fd from the page cache. Returns False if the OS cannot."""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        return True
+    # posix_fadvise returns an error number rather than setting errno
+    return posix_fadvise is not None and posix_fadvise(fd, 0, 0, POSIX_FADV_DONTNEED) == 0
+
+
+def madvise_dontneed(mm):
+    """Release the pages of a memory map from the process, e.g. once its dirty pages are written.
+
+    Returns False if the OS cannot.
+    """
+    if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_DONTNEED'):
+        mm.madvise(mmap.MADV_DONTNEED)
+        return True
+    if madvise is None:
+        return False
+    # the address of the map, which is page-aligned
+    address = np.frombuffer(mm, dtype=np.uint8).ctypes.data
+    return madvise(address, len(mm), MADV_DONTNEED) == 0
+
+
+def drop_cache(fd):
+    """Write the dirty pages of fd to disk and drop its pages from the page cache.
+
+    Returns False if the pages could only be written, and not dropped.
+    """
+    # fdatasync is not available everywhere
+    if hasattr(os, 'fdatasync'):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+    return fadvise_dontneed(fd)
+
+
+def drop_file_cache(path):
+    """Drop the pages of the file path from the page cache, e.g. before and after reading it."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return drop_cache(fd)
+    finally:
+        os.close(fd)
+
+
+def punch_hole(fd, offset, length):
+    """Deallocate a range of a file, which then reads as zeros, without writing to it.
+
+    Only the whole file system blocks of the range are freed, the rest is
+    zeroed. Returns False if the OS or the file system cannot punch holes.
+    """
+    if fallocate is None:
+        return False
+    if fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        # EOPNOTSUPP, ENOSYS...
+        return False
+    return True
+
+
+def read_at(fileobj, buf, offset):
+    """Read into buf from offset, stopping at the end of the file."""
+    fileobj.seek(offset)
+    pos = 0
+    while pos < len(buf):
+        read = fileobj.readinto(buf[pos:])
+        # a short read is the end of the file, past which O_DIRECT offsets are no longer aligned
+        if not read or read % alignment:
+            break
+        pos += read
+
+
+def write_at(fileobj, buf, offset):
+    fileobj.seek(offset)
+    pos = 0
+    while pos < len(buf):
+        pos += fileobj.write(buf[pos:])
+
+
+def segments(runs, segment_bytes):
+    """Group runs of bytes to be written into aligned segments of at most segment_bytes.
+
+    runs are (offset, data) pairs in offset order, and segment_bytes a
+    multiple of the alignment. Runs are grouped while their aligned pages
+    touch or overlap, and runs longer than a segment are split. Yields the
+    aligned start and end of each segment, and its (offset, bytes) pieces.
+    """
+    start = end = None
+    pieces = []
+    for offset, data in runs:
+        data = np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+        while len(data):
+            if pieces and (align_down(offset) > end or offset >= start + segment_bytes):
+                yield start, end, pieces
+                pieces = []
+            if not pieces:
+                start = align_down(offset)
+            piece = data[:start + segment_bytes - offset]
+            pieces.append((offset, piece))
+            end = align_up(offset + len(piece))
+            offset += len(piece)
+            data = data[len(piece):]
+    if pieces:
+        yield start, end, pieces
+
+
+class DirectWriter(object):
+    """Write-only file object writing sequentially through an aligned buffer.
+
+    Data is copied into a buffer of buffer_bytes bytes, which is written
+    whenever it is full. The last, partial buffer is padded to the alignment
+    and the padding truncated on close. Without O_DIRECT, the written pages
+    are dropped from the page cache after every buffer.
+    """
+
+    def __init__(self, path, buffer_bytes=16*1024**2):
+        self.fd, self.direct = open_direct(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        self.file = io.FileIO(self.fd, 'w')
+        self.buffer = aligned_buffer(buffer_bytes)
+        self.used = 0
+        self.size = 0
+
+    def write(self, data):
+        data = np.frombuffer(data, dtype=np.uint8)
+        while len(data):
+            copied = min(len(data), len(self.buffer) - self.used)
+            self.buffer[self.used:self.used + copied] = data[:copied]
+            self.used += copied
+            data = data[copied:]
+            if self.used == len(self.buffer):
+                self._write_buffer()
+
+    def _write_buffer(self):
+        write_at(self.file, self.buffer[:align_up(self.used)], self.size)
+        self.size += self.used
+        self.used = 0
+        if not self.direct:
+            drop_cache(self.fd)
+
+    def tell(self):
+        # bytes written so far, including those still in the buffer
+        return self.size + self.used
+
+    def flush(self):
+        # only whole buffers can be written before close
+        pass
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.used:
+            self._write_buffer()
+        os.ftruncate(self.fd, self.size)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,207 @@
+import nibabel as nib
+import os
+import numpy as np
+import argparse
+from multiprocessing import Pool
+from time import time
+from block_index import block_filename
+from merge_bb import image_header, load_bytes, open_output
+
+# Deterministic synthetic stand-in for BigBrain, of any shape and dtype, and
+# its blocks, so that the split and merge benchmarks can run without the
+# real data. Voxel values are a hash of the voxel coordinates and of a seed,
+# inside an ellipsoid filling the image ("the brain"), and 0 outside. Any
+# part of the image can thus be generated on its own: the image is written
+# slab by slab, and every block is generated independently of the image.
+#
+# Blocks are cut on a grid of y, z and x splits (slabs: 1 1 n). Each block
+# header holds the world start of the block in its description, and the
+# voxel size in pixdim, as minc2nifti.py writes them. Blocks are named and
+# listed either as imageutils does (bigbrain_<y>_<z>_<x>.nii and a
+# legend.txt), or as reconstruct_bb.py expects them (block-0NNN-inv.nii and
+# a legend image of block numbers).
+#
+# Blocks outside the ellipsoid are all zeros. A sparse split does not write
+# them, and lists them in legend.txt with their shape and dtype instead (see
+# block_index.py).
+
+
+def synthetic_data(start, shape, image_shape, dtype, seed=0):
+    """Return the voxels of the synthetic image in the box of the given start and shape, in Fortran order."""
+    dtype = np.dtype(dtype)
+    y, z, x = np.ogrid[start[0]:start[0] + shape[0], start[1]:start[1] + shape[1], start[2]:start[2] + shape[2]]
+
+    # coordinate hash, with the multiplicative mixing of splitmix64
+    h = (y.astype(np.uint64) * np.uint64(73856093)) ^ (z.astype(np.uint64) * np.uint64(19349663)) ^ \
+        (x.astype(np.uint64) * np.uint64(83492791)) ^ np.uint64(seed)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    h ^= h >> np.uint64(31)
+
+    if dtype.kind == 'f':
+        values = (h >> np.uint64(11)).astype(np.float64) / 2.0**53
+    else:
+        values = h % np.uint64(min(np.iinfo(dtype).max, 2**32 - 1) + 1)
+
+    centre = [(d - 1) / 2.0 for d in image_shape]
+    radius = [max(d / 2.0, 1) for d in image_shape]
+    inside = ((y - centre[0]) / radius[0])**2 + ((z - centre[1]) / radius[1])**2 + \
+             ((x - centre[2]) / radius[2])**2 <= 1
+
+    data = np.zeros(shape, dtype=dtype, order='F')
+    data[...] = np.where(inside, values, 0)
+    return data
+
+
+def split_edges(dim, splits):
+    """Return the first voxel of each of the splits blocks along a dimension, and dim."""
+    return [i * dim // splits for i in range(0, splits + 1)]
+
+
+def block_grid(image_shape, splits):
+    """Return the (y, z, x) start and shape of every block, in legend order (x, y, z)."""
+    edges = [split_edges(d, s) for d, s in zip(image_shape, splits)]
+    return [((edges[0][i], edges[1][j], edges[2][k]),
+             (edges[0][i + 1] - edges[0][i], edges[1][j + 1] - edges[1][j], edges[2][k + 1] - edges[2][k]))
+            for k in range(0, splits[2]) for i in range(0, splits[0]) for j in range(0, splits[1])]
+
+
+def write_image(image_fn, image_shape, dtype, seed=0, mem=256*1024**2):
+    """Write the whole synthetic image, mem bytes of voxels at a time."""
+    # the hash uses about 4 uint64 temporaries per voxel
+    plane_bytes = image_shape[0] * image_shape[1] * 4 * np.dtype(np.uint64).itemsize
+    slab_planes = max(1, mem // plane_bytes)
+
+    compression = 'gzip' if image_fn.endswith('.gz') else None
+    image, raw = open_output(image_fn, compression)
+    image.write(image_header(image_shape, np.dtype(dtype)))
+    for x0 in range(0, image_shape[2], slab_planes):
+        x1 = min(x0 + slab_planes, image_shape[2])
+        image.write(load_bytes(synthetic_data((0, 0, x0), image_shape[:2] + (x1 - x0,), image_shape, dtype, seed)))
+    image.close()
+    raw.close()
+
+
+def write_block(job):
+    """Write a block, and return its file name, or None for an all-zero block of a sparse split."""
+    block_fn, start, shape, image_shape, dtype, seed, step, sparse = job
+    data = synthetic_data(start, shape, image_shape, dtype, seed)
+    if sparse and not data.any():
+        return None
+    block = nib.Nifti1Image(data, np.eye(4))
+    block.header['descrip'] = '{0} {1} {2}'.format(*[round(s * step, 6) for s in start])
+    block.header['pixdim'][1:4] = step
+    nib.save(block, block_fn)
+    return block_fn
+
+
+def write_blocks(out_dir, image_shape, dtype, splits, naming='text', prefix='bigbrain', gzip=False,
+                 seed=0, step=0.04, jobs=None, sparse=False):
+    """Write the blocks of the synthetic image and their legend in out_dir.
+
+    naming is 'text' (imageutils: bigbrain_<y>_<z>_<x>.nii and legend.txt)
+    or 'legend' (reconstruct_bb.py: <prefix>-0NNN-inv.nii and legend.nii).
+    Blocks are written by a pool of jobs processes (default: one per CPU).
+    If sparse (text naming only), all-zero blocks are listed in the legend
+    instead of being written.
+    Returns the legend file name, and the number of blocks and voxel bytes
+    not written.
+    """
+    if sparse and naming != 'text':
+        raise ValueError('sparse splits need a text legend, which lists the zero blocks')
+    extension = '.nii.gz' if gzip else '.nii'
+    grid = block_grid(image_shape, splits)
+
+    if naming == 'text':
+        block_fns = [os.path.join(os.path.abspath(out_dir), '{0}_{1}_{2}_{3}{4}'.format(prefix, *(start + (extension,))))
+                     for start, shape in grid]
+    else:
+        block_fns = [block_filename(out_dir, prefix, block_num, 'inv' + extension)
+                     for block_num in range(1, len(grid) + 1)]
+
+    pool = Pool(jobs)
+    try:
+        written = pool.map(write_block, [(block_fn, start, shape, image_shape, dtype, seed, step, sparse)
+                                         for block_fn, (start, shape) in zip(block_fns, grid)], chunksize=16)
+    finally:
+        pool.close()
+        pool.join()
+
+    zero = [(block_fn, shape) for block_fn, (start, shape), result in zip(block_fns, grid, written) if result is None]
+    zero_bytes = sum(int(np.prod(shape)) for block_fn, shape in zero) * np.dtype(dtype).itemsize
+
+    if naming == 'text':
+        legend_fn = os.path.join(out_dir, 'legend.txt')
+        with open(legend_fn, 'w') as f:
+            for block_fn, (start, shape), result in zip(block_fns, grid, written):
+                if result is None:
+                    f.write('{0} zero {1} {2} {3} {4}\n'.format(block_fn, shape[0], shape[1], shape[2],
+                                                                 np.dtype(dtype).name))
+                else:
+                    f.write(block_fn + '\n')
+    else:
+        # one voxel per block, numbered in legend order
+        legend = np.arange(1, len(grid) + 1, dtype=np.int32).reshape((splits[2], splits[0], splits[1]))
+        legend_fn = os.path.join(out_dir, 'legend.nii')
+        nib.save(nib.Nifti1Image(legend.transpose(1, 2, 0), np.eye(4)), legend_fn)
+
+    return legend_fn, len(zero), zero_bytes
+
+
+if __name__ == "__main__":
+
+    # sample commands:
+    # python generate_dataset.py /tmp/blocks125 -s 385 302 350 -n 5 -i /tmp/bigbrain.nii
+    # python generate_dataset.py /tmp/blocks64000 -s 385 302 350 -n 40 --naming legend --prefix block -z
+    # python generate_dataset.py /tmp/slices350 -s 385 302 350 -n 1 1 350
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic image and its blocks')
+    parser.add_argument('out_dir', type=str, help="Folder the blocks and their legend are written to")
+    parser.add_argument('-s', '--shape', type=int, nargs=3, required=True, help="Image shape (y, z, x)")
+    parser.add_argument('-d', '--dtype', type=str, default='uint16', help="Numpy datatype of the voxels")
+    parser.add_argument('-n', '--splits', type=int, nargs='+', default=[5],
+                        help="Number of blocks along y, z and x, or a single number for all three "
+                             "(slabs: 1 1 n)")
+    parser.add_argument('-i', '--image', type=str, default=None,
+                        help="Also write the whole image to this file (.nii or .nii.gz)")
+    parser.add_argument('--naming', choices=['text', 'legend'], default='text',
+                        help="text: bigbrain_<y>_<z>_<x>.nii blocks and legend.txt, as written by imageutils; "
+                             "legend: <prefix>-0NNN-inv.nii blocks and legend.nii, as read by reconstruct_bb.py")
+    parser.add_argument('-p', '--prefix', type=str, default='bigbrain', help="Block name prefix")
+    parser.add_argument('-z', '--gzip', action='store_true', help="gzip the blocks")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the voxel values")
+    parser.add_argument('--step', type=float, default=0.04, help="Voxel size written in the block headers")
+    parser.add_argument('-m', '--mem', type=int, default=256*1024**2,
+                        help="Memory used to generate each slab of the whole image, in bytes")
+    parser.add_argument('--sparse', action='store_true',
+                        help="Text naming only: list the all-zero blocks in legend.txt instead of writing them")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="Number of processes writing blocks (default: one per CPU)")
+
+    args = parser.parse_args()
+
+    image_shape = tuple(args.shape)
+    splits = args.splits * 3 if len(args.splits) == 1 else args.splits
+    if len(splits) != 3:
+        parser.error('--splits takes 1 or 3 values')
+    if args.sparse and args.naming != 'text':
+        parser.error('--sparse needs --naming text')
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    s_time = time()
+    if args.image:
+        write_image(args.image, image_shape, args.dtype, args.seed, args.mem)
+    t = time()
+    legend_fn, zero_blocks, zero_bytes = write_blocks(args.out_dir, image_shape, args.dtype, splits, args.naming,
+                                                      args.prefix, args.gzip, args.seed, args.step, args.jobs,
+                                                      args.sparse)
+    blocks_time = time() - t
+    print('{0} blocks and {1} written in {2}s'.format(np.prod(splits) - zero_blocks, legend_fn, time() - s_time))
+    if args.sparse:
+        # at the throughput of the blocks written
+        written_bytes = int(np.prod(image_shape)) * np.dtype(args.dtype).itemsize - zero_bytes
+        print('{0} all-zero blocks listed in the legend instead, {1} bytes of voxels not written, '
+              'estimated time saved: {2}s'.format(zero_blocks, zero_bytes,
+                                                  zero_bytes * blocks_time / written_bytes if written_bytes else 0))
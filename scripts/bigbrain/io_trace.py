@@ -0,0 +1,236 @@
+import nibabel as nib
+import gzip
+import numpy as np
+import argparse
+import os
+import threading
+from time import time
+
+# Opt-in tracing of every read, write and seek of a split or merge, to see
+# what the aggregate seek counts of benchmark mode hide: how far each seek
+# jumps, and what it costs.
+#
+# Files are wrapped in a TracedFile, which records each operation (file,
+# offset, length, start time, duration) in the preallocated ring buffer of a
+# Tracer. Without a trace file, the ring keeps the last records. With a trace
+# file, the ring is appended to it whenever it is full, and the names of the
+# traced files are written next to it (<trace file>.files) on close.
+#
+# The summary (python io_trace.py <trace file>) gives histograms of the seek
+# distances, the gaps between consecutive operations on a file, and of the
+# operation sizes, with the mean duration of the operations in each bin.
+
+ops = ['read', 'write', 'seek']
+READ, WRITE, SEEK = range(0, len(ops))
+
+# seek records hold the new position as offset, and the distance from the
+# previous position as length
+trace_dtype = np.dtype([('op', '<u1'), ('file', '<u4'), ('offset', '<i8'), ('length', '<i8'),
+                        ('start', '<f8'), ('duration', '<f8')])
+
+
+class Tracer(object):
+    """Ring buffer of I/O records, optionally appended to a binary trace file."""
+
+    def __init__(self, trace_fn=None, capacity=2**20):
+        self.records = np.zeros(capacity, dtype=trace_dtype)
+        self.count = 0
+        self.written = 0
+        self.files = []
+        self.file_ids = {}
+        self.trace_fn = trace_fn
+        self.trace = open(trace_fn, 'wb') if trace_fn else None
+        # records come from reader and writer threads
+        self.lock = threading.Lock()
+
+    def file_id(self, name):
+        with self.lock:
+            if name not in self.file_ids:
+                self.file_ids[name] = len(self.files)
+                self.files.append(name)
+            return self.file_ids[name]
+
+    def record(self, op, file_id, offset, length, start, duration):
+        with self.lock:
+            i = self.count % len(self.records)
+            self.records[i] = (op, file_id, offset, length, start, duration)
+            self.count += 1
+            if self.trace and i == len(self.records) - 1:
+                self._write()
+
+    def _write(self):
+        first = self.written % len(self.records)
+        end = first + self.count - self.written
+        self.records[first:end].tofile(self.trace)
+        self.written = self.count
+
+    def recorded(self):
+        """Return the records held by the ring buffer, in order."""
+        with self.lock:
+            if self.count <= len(self.records):
+                return self.records[:self.count].copy()
+            i = self.count % len(self.records)
+            return np.concatenate([self.records[i:], self.records[:i]])
+
+    def close(self):
+        with self.lock:
+            if self.trace:
+                self._write()
+                self.trace.close()
+                self.trace = None
+                with open(self.trace_fn + '.files', 'w') as f:
+                    for name in self.files:
+                        f.write(name + '\n')
+
+
+class TracedFile(object):
+    """File object recording its reads, writes and seeks in a Tracer."""
+
+    def __init__(self, fileobj, tracer, name):
+        self.fileobj = fileobj
+        self.tracer = tracer
+        self.file_id = tracer.file_id(name)
+        self.position = fileobj.tell()
+
+    def read(self, size=-1):
+        t = time()
+        data = self.fileobj.read(size)
+        self.tracer.record(READ, self.file_id, self.position, len(data), t, time() - t)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buf):
+        t = time()
+        read = self.fileobj.readinto(buf)
+        self.tracer.record(READ, self.file_id, self.position, read or 0, t, time() - t)
+        self.position += read or 0
+        return read
+
+    def write(self, data):
+        # bytes, or numpy arrays
+        length = data.nbytes if hasattr(data, 'nbytes') else len(data)
+        t = time()
+        written = self.fileobj.write(data)
+        self.tracer.record(WRITE, self.file_id, self.position, length, t, time() - t)
+        self.position += length
+        return written
+
+    def seek(self, offset, whence=0):
+        t = time()
+        result = self.fileobj.seek(offset, whence)
+        position = self.fileobj.tell()
+        self.tracer.record(SEEK, self.file_id, position, position - self.position, t, time() - t)
+        self.position = position
+        return result
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.fileobj.close()
+
+    def __getattr__(self, name):
+        # flush, fileno, closed, mode...
+        return getattr(self.fileobj, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_traced(path, mode, tracer):
+    return TracedFile(open(path, mode), tracer, os.path.abspath(path))
+
+
+def open_image(path, tracer):
+    """Return a nibabel image read through a traced file, and the file, to be closed once the data is read."""
+    f = open_traced(path, 'rb', tracer)
+    # the traced reads of a gzipped image are those of its compressed bytes
+    fileobj = gzip.GzipFile(fileobj=f, mode='rb') if path.endswith('.gz') else f
+    holder = nib.FileHolder(path, fileobj)
+    return nib.Nifti1Image.from_file_map({'header': holder, 'image': holder}), f
+
+
+def load_trace(trace_fn):
+    """Return the records of a trace file and the names of its files."""
+    records = np.fromfile(trace_fn, dtype=trace_dtype)
+    files = []
+    if os.path.exists(trace_fn + '.files'):
+        with open(trace_fn + '.files') as f:
+            files = [line.rstrip('\n') for line in f]
+    return records, files
+
+
+def seek_distances(records):
+    """Return the gap between every read or write and the end of the previous read or write of its file,
+    and the duration of the operation after the gap."""
+    data = records[records['op'] != SEEK]
+    # stable sort: records of a file stay in order
+    data = data[np.argsort(data['file'], kind='mergesort')]
+    same_file = data['file'][1:] == data['file'][:-1]
+    gaps = data['offset'][1:] - (data['offset'][:-1] + data['length'][:-1])
+    return gaps[same_file], data['duration'][1:][same_file]
+
+
+def log2_bins(values):
+    """Return the power of 2 bin of each absolute value (0 for 0, k for [2^(k-1), 2^k)), signed like the value."""
+    magnitude = np.where(values == 0, 0, np.floor(np.log2(np.maximum(np.abs(values), 1))).astype(np.int64) + 1)
+    return np.sign(values) * magnitude
+
+
+def bin_label(b):
+    if b == 0:
+        return '0'
+    low, high = 2**(abs(b) - 1), 2**abs(b)
+    return '{0}[{1}, {2})'.format('-' if b < 0 else '', low, high)
+
+
+def histogram(values, durations):
+    """Return the bins of values (see log2_bins), with the count, mean duration and sum of each."""
+    labels, inverse = np.unique(log2_bins(values), return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(labels))
+    mean_durations = np.bincount(inverse, durations, minlength=len(labels)) / np.maximum(counts, 1)
+    totals = np.bincount(inverse, values.astype(np.float64), minlength=len(labels))
+    return labels, counts, mean_durations, totals
+
+
+def summary(records):
+    """Return the lines of the histograms of seek distances and operation sizes of records."""
+    lines = []
+    gaps, durations = seek_distances(records)
+    seeks = gaps != 0
+    lines.append('{0} operations, {1} seeks (non-contiguous reads and writes), {2} seek calls'.format(
+        len(records), int(seeks.sum()), int((records['op'] == SEEK).sum())))
+
+    lines.append('')
+    lines.append('seek distance (bytes)        count   mean duration of the next operation (s)')
+    for label, count, duration, total in zip(*histogram(gaps, durations)):
+        lines.append('{0:<28} {1:>6} {2:.6f}'.format(bin_label(label), count, duration))
+
+    for op in (READ, WRITE):
+        selected = records[records['op'] == op]
+        if not len(selected):
+            continue
+        lines.append('')
+        lines.append('{0} size (bytes)              count   mean duration (s)   total bytes'.format(ops[op]))
+        for label, count, duration, total in zip(*histogram(selected['length'], selected['duration'])):
+            lines.append('{0:<28} {1:>6} {2:.6f}            {3:.0f}'.format(bin_label(label), count, duration, total))
+    return lines
+
+
+if __name__ == "__main__":
+
+    # sample command: python io_trace.py /tmp/merge.trace
+
+    parser = argparse.ArgumentParser(description='Summarize an I/O trace: seek distance and I/O size histograms')
+    parser.add_argument('trace', type=str, help="Trace file written with --trace")
+    parser.add_argument('-f', '--file', type=str, default=None,
+                        help="Only summarize the operations on this file (a name of <trace>.files)")
+    args = parser.parse_args()
+
+    records, files = load_trace(args.trace)
+    if args.file:
+        records = records[records['file'] == files.index(os.path.abspath(args.file))]
+    print('\n'.join(summary(records)))
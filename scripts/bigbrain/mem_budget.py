@@ -0,0 +1,143 @@
+import resource
+import threading
+
+# Accounting and enforcement of the memory budget (mem) of the buffered
+# algorithms. mem only sizes the buffers of an algorithm: the process also
+# holds the interpreter, the libraries, the block index, and the temporary
+# arrays of every read. A MemoryBudget records the buffer bytes, RSS and
+# peak RSS of every memory load, and in strict mode keeps the process within
+# mem plus a fixed overhead:
+#   - the data segment of the process (VmData, its private writable memory)
+#     is limited to its size at the start plus mem and the overhead
+#     (RLIMIT_DATA), so that an allocation over the budget raises a
+#     MemoryError instead of the job being killed by the scheduler. Linux
+#     only counts memory maps, as used for large numpy arrays, from 4.7;
+#   - the RSS is checked after every memory load.
+# Algorithms that do not account their loads (e.g. those of imageutils) can
+# have their RSS sampled at a fixed interval instead, by an RssSampler; the
+# buffer bytes of these samples are unknown.
+# RSS and peak RSS are read from /proc/self/status where it exists, and
+# from getrusage otherwise (peak only).
+
+default_overhead = 256*1024**2
+
+
+def proc_status(field):
+    """Return a field of /proc/self/status in bytes, or None if there is no such file or field."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    # e.g. VmRSS:     1234 kB
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
+
+def peak_rss():
+    peak = proc_status('VmHWM')
+    # ru_maxrss is in kilobytes on Linux
+    return peak if peak is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def rss():
+    current = proc_status('VmRSS')
+    return current if current is not None else peak_rss()
+
+
+def reset_peak_rss():
+    """Reset the peak RSS to the current RSS (Linux 4.0 and later). Returns whether it was reset."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+class MemoryBudget(object):
+    """Memory accounting of a run, and optionally enforcement of mem plus overhead bytes (strict).
+
+    Use as a context manager around the run. loads holds the
+    (buffer bytes, RSS, peak RSS) of every memory load accounted, and of
+    every RSS sample, whose buffer bytes are None.
+    """
+
+    def __init__(self, mem, overhead=default_overhead, strict=False):
+        self.mem = mem
+        self.overhead = overhead
+        self.strict = strict
+        self.loads = []
+        self.limit = None
+
+    def __enter__(self):
+        reset_peak_rss()
+        self.start_rss = rss()
+        if self.strict:
+            data = proc_status('VmData')
+            if data is not None:
+                soft, hard = resource.getrlimit(resource.RLIMIT_DATA)
+                self.previous_limit = (soft, hard)
+                limit = data + self.mem + self.overhead
+                if hard != resource.RLIM_INFINITY:
+                    limit = min(limit, hard)
+                resource.setrlimit(resource.RLIMIT_DATA, (limit, hard))
+                self.limit = limit
+        return self
+
+    def __exit__(self, *args):
+        if self.limit is not None:
+            resource.setrlimit(resource.RLIMIT_DATA, self.previous_limit)
+            self.limit = None
+        self.peak_rss = peak_rss()
+
+    def account(self, buffer_bytes):
+        """Record a memory load of buffer_bytes. In strict mode, raise MemoryError if the RSS is over budget."""
+        current = rss()
+        self.loads.append((buffer_bytes, current, peak_rss()))
+        if self.strict and current > self.start_rss + self.mem + self.overhead:
+            raise MemoryError('RSS of {0} bytes over the budget of {1} bytes ({2} at start, mem {3}, overhead '
+                              '{4})'.format(current, self.start_rss + self.mem + self.overhead, self.start_rss,
+                                            self.mem, self.overhead))
+
+    def sample(self):
+        """Record the RSS and peak RSS between memory loads, with unknown (None) buffer bytes."""
+        self.loads.append((None, rss(), peak_rss()))
+
+    def max_buffer_bytes(self):
+        """Return the buffer bytes of the largest memory load accounted, or None if none was."""
+        known = [load[0] for load in self.loads if load[0] is not None]
+        return max(known) if known else None
+
+    def write_log(self, log_fn):
+        """Write the accounting of every memory load as a CSV file, unknown buffer bytes being empty."""
+        with open(log_fn, 'w') as f:
+            f.write('load,buffer_bytes,rss,peak_rss\n')
+            for i, (buffer_bytes, current, peak) in enumerate(self.loads):
+                f.write('{0},{1},{2},{3}\n'.format(i, '' if buffer_bytes is None else buffer_bytes, current, peak))
+
+
+class RssSampler(object):
+    """Thread sampling the RSS of a MemoryBudget every interval seconds, while used as a context manager."""
+
+    def __init__(self, budget, interval=1.0):
+        self.budget = budget
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.budget.sample()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+        # the RSS at the end of the run
+        self.budget.sample()
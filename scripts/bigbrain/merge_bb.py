@@ -0,0 +1,481 @@
+import nibabel as nib
+import gzip
+import numpy as np
+import argparse
+import os
+import sys
+import threading
+from io import BytesIO
+from multiprocessing import Pool
+from time import time
+from nibabel.arraywriters import make_array_writer, get_slope_inter
+from numpy.lib.stride_tricks import as_strided
+from block_index import load_block_index
+from bgzf import BlockGzipWriter
+from direct_io import DirectWriter, drop_file_cache
+from io_trace import Tracer, TracedFile, open_image
+from mem_budget import MemoryBudget, default_overhead
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+# Multiple reads merge of blocks into a new image. The reconstructed image is
+# built in memory loads of whole x-planes, which are written one after the
+# other. The image is therefore written without seeking, and can be
+# compressed on the fly.
+#
+# A plain image can also be merged in parallel: every memory load is a
+# contiguous range of the image, at an offset known in advance, so the loads
+# are partitioned into ranges of consecutive loads, which workers (local
+# processes, or nodes sharing the file system of the image) write with no
+# coordination. Each worker only reads the blocks that overlap its loads.
+
+
+def image_header(shape, dtype):
+    """Return the header of a NIfTI-1 image of the given shape and dtype, as bytes up to its data offset."""
+    # A zero-strided array gives the image its shape and dtype without using memory
+    data = as_strided(np.zeros(1, dtype=dtype), shape=shape, strides=(0,) * len(shape))
+    img = nib.Nifti1Image(data, np.eye(4))
+
+    # Same header preparation as nibabel's to_file_map
+    img.update_header()
+    hdr = img.header
+    arr_writer = make_array_writer(data, hdr.get_data_dtype(), hdr.has_data_slope, hdr.has_data_intercept)
+    hdr.set_slope_inter(*get_slope_inter(arr_writer))
+
+    header = BytesIO()
+    hdr.write_to(header)
+    header.write(b'\x00' * (hdr.get_data_offset() - header.tell()))
+    return header.getvalue()
+
+
+def block_x_ranges(index):
+    """Return the first and last + 1 x-planes of each block, used to find the blocks of a memory load."""
+    return index['position'][:, 2], index['position'][:, 2] + index['shape'][:, 2]
+
+
+def read_load(index, x_range, bb_shape, dtype, x_ranges, tracer=None, uncached=False):
+    """Read the x-planes x_range of the reconstructed image from the blocks that contain them.
+
+    Only the planes of each block that fall in the load are read, through
+    the block's array proxy, and traced if a tracer is given. Zero blocks of
+    sparse splits are not read. If uncached, every block is dropped from the
+    page cache before and after it is read, so that it is read from the
+    device. Returns the load, in Fortran order, and the number of blocks
+    read.
+    """
+    x0, x1 = x_range
+    load = np.zeros((bb_shape[0], bb_shape[1], x1 - x0), dtype=dtype, order='F')
+
+    block_x0, block_x1 = x_ranges
+    overlapping = np.nonzero((block_x0 < x1) & (block_x1 > x0) & ~index['zero'])[0]
+
+    for i in overlapping:
+        y, z, x = index['position'][i]
+        ydim, zdim, xdim = index['shape'][i]
+        start = max(x0, x)
+        end = min(x1, x + xdim)
+        if uncached:
+            drop_file_cache(str(index['path'][i]))
+        if tracer:
+            img, f = open_image(str(index['path'][i]), tracer)
+            try:
+                load[y:y + ydim, z:z + zdim, start - x0:end - x0] = img.dataobj[:, :, start - x:end - x]
+            finally:
+                f.close()
+        else:
+            block = nib.load(str(index['path'][i])).dataobj
+            load[y:y + ydim, z:z + zdim, start - x0:end - x0] = block[:, :, start - x:end - x]
+        if uncached:
+            drop_file_cache(str(index['path'][i]))
+
+    return load, len(overlapping)
+
+
+def read_loads(index, bb_shape, dtype, load_planes, tracer=None, x_range=None, uncached=False):
+    """Yield (load, blocks read, read time) for each memory load of load_planes x-planes, in order.
+
+    x_range restricts the loads to those x-planes (default: all).
+    """
+    x_ranges = block_x_ranges(index)
+    x_start, x_end = x_range or (0, bb_shape[2])
+    for x0 in range(x_start, x_end, load_planes):
+        t = time()
+        load, blocks_read = read_load(index, (x0, min(x0 + load_planes, x_end)), bb_shape, dtype, x_ranges,
+                                      tracer, uncached)
+        yield load, blocks_read, time() - t
+
+
+def pipelined_loads(index, bb_shape, dtype, load_planes, tracer=None, uncached=False):
+    """Same as read_loads, but a reader thread reads the next load while the caller writes the current one.
+
+    At most two loads exist at a time: the caller must drop its reference to
+    a load before asking for the next one.
+    """
+    buffers = threading.Semaphore(2)
+    loads = Queue(maxsize=1)
+    x_ranges = block_x_ranges(index)
+
+    def reader():
+        try:
+            for x0 in range(0, bb_shape[2], load_planes):
+                buffers.acquire()
+                t = time()
+                load, blocks_read = read_load(index, (x0, min(x0 + load_planes, bb_shape[2])), bb_shape, dtype,
+                                              x_ranges, tracer, uncached)
+                loads.put((load, blocks_read, time() - t))
+                del load
+            loads.put(None)
+        except Exception as e:
+            loads.put(e)
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        item = loads.get()
+        if item is None:
+            break
+        if isinstance(item, Exception):
+            raise item
+        yield item
+        del item
+        buffers.release()
+
+    thread.join()
+
+
+def load_bytes(load):
+    # the transpose of a Fortran-ordered array exposes its buffer in NIfTI order
+    return load.T.reshape(-1).view(np.uint8)
+
+
+def planes_per_load(index, bb_shape, dtype, mem, load_count=1, strict=False):
+    """Return the number of x-planes of each of load_count memory loads fitting in mem bytes.
+
+    Loads hold at least one x-plane, unless strict: they then also fit with
+    the temporary arrays of their block reads, and a ValueError is raised
+    if a single x-plane does not.
+    """
+    plane_bytes = bb_shape[0] * bb_shape[1] * dtype.itemsize
+    if not strict:
+        return max(1, mem // load_count // plane_bytes)
+
+    # a block read allocates its planes of the load before they are copied into it
+    read_plane_bytes = int((index['shape'][:, 0] * index['shape'][:, 1]).max()) * dtype.itemsize
+    load_planes = mem // load_count // (plane_bytes + read_plane_bytes)
+    if load_planes == 0:
+        raise ValueError('mem of {0} bytes is less than {1} load(s) of one x-plane ({2} bytes each)'.format(
+            mem, load_count, plane_bytes + read_plane_bytes))
+    return load_planes
+
+
+def open_output(output, compression=None, threads=4, compresslevel=6, direct=False, tracer=None):
+    """Open the reconstructed image for writing.
+
+    compression is None (plain image), 'gzip' (single-threaded, on the fly)
+    or 'bgzf' (independent gzip members compressed by a pool of threads).
+    If direct, the image is written with O_DIRECT, bypassing the page cache.
+    If a tracer is given, the writes of the underlying file are traced.
+    Returns the file object to write to, and the underlying file, which is
+    to be closed after it.
+    """
+    raw = DirectWriter(output) if direct else open(output, 'wb')
+    if tracer:
+        raw = TracedFile(raw, tracer, os.path.abspath(output))
+    if compression == 'gzip':
+        return gzip.GzipFile(output, 'wb', compresslevel, fileobj=raw), raw
+    if compression == 'bgzf':
+        return BlockGzipWriter(raw, threads, compresslevel=compresslevel), raw
+    return raw, raw
+
+
+def merge(legend_fn, output, mem, block_folder='', block_prefix='', block_suffix='',
+          compression=None, threads=4, pipelined=False, direct=False, tracer=None, budget=None,
+          benchmark=False):
+    """Merge the blocks of a legend into output with Multiple reads.
+
+    Each memory load holds as many whole x-planes of the reconstructed
+    image as fit in mem bytes (at least one). block_folder, block_prefix
+    and block_suffix are only needed for legend images.
+
+    If pipelined, mem is split between two loads: the next load is read
+    while the current one is written. The read time is then measured in
+    the reader thread, and read and write times overlap.
+
+    If direct, neither the blocks read nor the reconstructed image are left
+    in the page cache (see direct_io.py), so that runs need not drop the
+    page cache, as root, to start cold. If a tracer is given, every read of the blocks and write
+    of the reconstructed image is traced (see io_trace.py).
+
+    If a MemoryBudget is given, every memory load is accounted in it. A
+    strict budget also sizes the loads so that they fit in mem with the
+    temporary arrays of their block reads.
+    """
+    total_read_time = 0
+    total_write_time = 0
+    total_seek_time = 0
+    total_seek_number = 0
+
+    t = time()
+    index = load_block_index(legend_fn, block_folder, block_prefix, block_suffix)
+    bb_shape = tuple(int(d) for d in (index['position'] + index['shape']).max(axis=0))
+    dtype = np.dtype(str(index['dtype'][0]))
+    total_read_time += time() - t
+
+    load_count = 2 if pipelined else 1
+    load_planes = planes_per_load(index, bb_shape, dtype, mem, load_count, budget is not None and budget.strict)
+
+    if pipelined:
+        loads = pipelined_loads(index, bb_shape, dtype, load_planes, tracer, direct)
+    else:
+        loads = read_loads(index, bb_shape, dtype, load_planes, tracer, uncached=direct)
+
+    t = time()
+    reconstructed, raw = open_output(output, compression, threads, direct=direct, tracer=tracer)
+    reconstructed.write(image_header(bb_shape, dtype))
+    total_write_time += time() - t
+
+    for load, blocks_read, read_time in loads:
+        total_read_time += read_time
+        if budget is not None:
+            # the loads in memory: with pipelined reads, the next one may be read already.
+            # bgzf also holds copies of the members of the previous load waiting for compression
+            budget.account(load.nbytes * load_count + getattr(reconstructed, 'pending_bytes', 0))
+
+        t = time()
+        reconstructed.write(load_bytes(load))
+        total_write_time += time() - t
+        del load
+
+        # one seek per block read, and one per memory load written
+        total_seek_number += blocks_read + 1
+
+    t = time()
+    reconstructed.close()
+    raw.close()
+    total_write_time += time() - t
+
+    if benchmark:
+        return total_read_time, total_write_time, total_seek_time, total_seek_number
+
+
+def load_ranges(depth, load_planes, workers):
+    """Return the x-planes (first, last + 1) of the consecutive memory loads of each of workers.
+
+    Loads of load_planes x-planes are shared as evenly as possible; workers
+    left without loads get an empty range.
+    """
+    loads = -(-depth // load_planes)
+    bounds = [loads * w // workers for w in range(0, workers + 1)]
+    return [(min(first * load_planes, depth), min(end * load_planes, depth))
+            for first, end in zip(bounds[:-1], bounds[1:])]
+
+
+def pwrite(fd, buf, offset):
+    view = memoryview(buf)
+    while len(view):
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, 0)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+def merge_part(legend_fn, output, mem, worker, workers, block_folder='', block_prefix='', block_suffix='',
+               tracer=None, budget=None):
+    """Write the memory loads of worker (0 to workers - 1) into the plain image output.
+
+    Each worker creates output if needed and sizes it, so that workers can
+    start in any order; worker 0 also writes the header. Memory loads are
+    sized as in merge, with mem the memory of this worker.
+    Returns the read time, write time, seek time and seek number of the
+    worker, and the number of bytes it wrote.
+    """
+    read_time = 0
+    write_time = 0
+    seek_number = 0
+    written = 0
+
+    t = time()
+    index = load_block_index(legend_fn, block_folder, block_prefix, block_suffix)
+    bb_shape = tuple(int(d) for d in (index['position'] + index['shape']).max(axis=0))
+    dtype = np.dtype(str(index['dtype'][0]))
+    read_time += time() - t
+
+    plane_bytes = bb_shape[0] * bb_shape[1] * dtype.itemsize
+    load_planes = planes_per_load(index, bb_shape, dtype, mem, strict=budget is not None and budget.strict)
+    x_range = load_ranges(bb_shape[2], load_planes, workers)[worker]
+    header = image_header(bb_shape, dtype)
+
+    t = time()
+    fd = os.open(output, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, len(header) + bb_shape[2] * plane_bytes)
+        if worker == 0:
+            pwrite(fd, header, 0)
+            written += len(header)
+        write_time += time() - t
+
+        offset = len(header) + x_range[0] * plane_bytes
+        for load, blocks_read, load_read_time in read_loads(index, bb_shape, dtype, load_planes, tracer, x_range):
+            read_time += load_read_time
+            if budget is not None:
+                budget.account(load.nbytes)
+
+            t = time()
+            data = load_bytes(load)
+            pwrite(fd, data, offset)
+            write_time += time() - t
+            offset += len(data)
+            written += len(data)
+            del load, data
+
+            # one seek per block read, and one per memory load written
+            seek_number += blocks_read + 1
+    finally:
+        t = time()
+        os.close(fd)
+        write_time += time() - t
+
+    return read_time, write_time, 0, seek_number, written
+
+
+def merge_part_star(args):
+    return merge_part(*args)
+
+
+def parallel_merge(legend_fn, output, mem, workers, block_folder='', block_prefix='', block_suffix='',
+                   benchmark=False):
+    """Merge the blocks of a legend into the plain image output with workers local processes.
+
+    mem is shared between the workers. Read and write times are summed over
+    the workers, and therefore overlap.
+    """
+    # build the block index once, rather than in every worker
+    load_block_index(legend_fn, block_folder, block_prefix, block_suffix)
+    if os.path.exists(output):
+        os.remove(output)
+
+    pool = Pool(workers)
+    try:
+        parts = pool.map(merge_part_star, [(legend_fn, output, mem // workers, worker, workers, block_folder,
+                                            block_prefix, block_suffix) for worker in range(0, workers)],
+                         chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    if benchmark:
+        return tuple(sum(part[i] for part in parts) for i in range(0, 4))
+
+
+def scaling(legend_fn, output, mem, worker_counts, block_folder='', block_prefix='', block_suffix=''):
+    """Merge with each number of workers of worker_counts, and return the lines of a throughput report.
+
+    Speedup and efficiency are relative to the first number of workers.
+    """
+    lines = ['workers   time (s)   throughput (MB/s)   speedup   efficiency']
+    first_time = None
+    for workers in worker_counts:
+        t = time()
+        parallel_merge(legend_fn, output, mem, workers, block_folder, block_prefix, block_suffix)
+        total_time = time() - t
+        if first_time is None:
+            first_time = total_time
+        speedup = first_time / total_time
+        lines.append('{0:>7} {1:>10.3f} {2:>19.1f} {3:>9.2f} {4:>12.2f}'.format(
+            workers, total_time, os.path.getsize(output) / total_time / 1024**2, speedup,
+            speedup * worker_counts[0] / workers))
+    return lines
+
+
+if __name__ == "__main__":
+
+    # sample commands:
+    # python merge_bb.py /data/blocks125/legend.txt /data/reconstructed_bb.nii.gz -m 3221225472 -c bgzf
+    # python merge_bb.py /data/blocks125/legend.txt /data/reconstructed_bb.nii -m 3221225472 -D --trace merge.trace
+    # python merge_bb.py /data/blocks125/legend.txt /data/reconstructed_bb.nii -m 3221225472 --scaling 1 2 4 8
+
+    parser = argparse.ArgumentParser(description='Merge blocks into a new nifti image with Multiple reads')
+    parser.add_argument('legend', type=str, help="The legend image or legend.txt to be used for reconstruction")
+    parser.add_argument('output', type=str, help="The reconstructed image")
+    parser.add_argument('-m', '--mem', type=int, required=True, help="Memory used by each memory load, in bytes")
+    parser.add_argument('--blockfldr', type=str, default='', help="Legend images only: the folder containing the blocks")
+    parser.add_argument('--blockprfx', type=str, default='', help="Legend images only: the block name prefix")
+    parser.add_argument('--blocksffx', type=str, default='', help="Legend images only: the block name suffix")
+    parser.add_argument('-c', '--compression', choices=['gzip', 'bgzf'], default=None,
+                        help="Compress the reconstructed image on the fly, with gzip or with independent "
+                             "gzip members compressed in parallel (bgzf)")
+    parser.add_argument('-t', '--threads', type=int, default=4, help="Compression threads for bgzf")
+    parser.add_argument('-p', '--pipelined', action='store_true',
+                        help="Split mem between two loads and read the next load while writing the current one")
+    parser.add_argument('-D', '--direct', action='store_true',
+                        help="Read the blocks from the device, dropping them from the page cache, and write "
+                             "the reconstructed image with O_DIRECT, bypassing the page cache")
+    parser.add_argument('--trace', type=str, default=None,
+                        help="Trace every read and write to this file (summary: python io_trace.py TRACE)")
+    parser.add_argument('-s', '--strict', action='store_true',
+                        help="Keep the process within mem plus --overhead bytes, failing with a MemoryError "
+                             "rather than exceeding it (see mem_budget.py)")
+    parser.add_argument('--overhead', type=int, default=default_overhead,
+                        help="Memory allowed over mem in strict mode, in bytes")
+    parser.add_argument('--mem-log', type=str, default=None,
+                        help="Write the buffer bytes, RSS and peak RSS of every memory load to this CSV file")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="Merge a plain image with this many local processes sharing mem, each writing a "
+                             "range of memory loads")
+    parser.add_argument('--worker', type=int, default=None,
+                        help="Only write the memory loads of this worker (0 to WORKERS - 1), with mem bytes, "
+                             "e.g. one worker per node on a shared file system")
+    parser.add_argument('--scaling', type=int, nargs='+', default=None,
+                        help="Merge with each of these numbers of local processes and report the throughput "
+                             "(blocks read by a run may be cached for the next one)")
+    parser.add_argument('-b', '--benchmark', action='store_true', help="Print seek count and timings")
+
+    args = parser.parse_args()
+    parallel = args.workers > 1 or args.worker is not None or args.scaling
+    if parallel and (args.compression or args.pipelined or args.direct):
+        parser.error('parallel merges only write plain images, without --pipelined or --direct')
+    if parallel and (args.trace or args.strict or args.mem_log) and args.worker is None:
+        parser.error('--trace, --strict and --mem-log only apply to a single --worker of a parallel merge')
+    if args.worker is not None and not 0 <= args.worker < args.workers:
+        parser.error('--worker must be between 0 and WORKERS - 1')
+
+    if args.scaling:
+        print('\n'.join(scaling(args.legend, args.output, args.mem, args.scaling, args.blockfldr, args.blockprfx,
+                                args.blocksffx)))
+        sys.exit(0)
+
+    tracer = Tracer(args.trace) if args.trace else None
+    budget = MemoryBudget(args.mem, args.overhead, args.strict)
+
+    s_time = time()
+    with budget:
+        if args.worker is not None:
+            stats = merge_part(args.legend, args.output, args.mem, args.worker, args.workers, args.blockfldr,
+                               args.blockprfx, args.blocksffx, tracer=tracer, budget=budget)[:4]
+        elif args.workers > 1:
+            stats = parallel_merge(args.legend, args.output, args.mem, args.workers, args.blockfldr,
+                                   args.blockprfx, args.blocksffx, benchmark=args.benchmark)
+        else:
+            stats = merge(args.legend, args.output, args.mem, args.blockfldr, args.blockprfx, args.blocksffx,
+                          compression=args.compression, threads=args.threads, pipelined=args.pipelined,
+                          direct=args.direct, tracer=tracer, budget=budget, benchmark=args.benchmark)
+    total_time = time() - s_time
+
+    if tracer:
+        tracer.close()
+    if args.mem_log:
+        budget.write_log(args.mem_log)
+
+    if args.benchmark:
+        print('peak RSS: {0} bytes, largest buffers: {1} bytes'.format(
+            budget.peak_rss, budget.max_buffer_bytes() or 0))
+        # (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time)
+        print(' '.join(str(e) for e in stats + (total_time,)))
@@ -2,8 +2,17 @@ import nibabel as nib
 import h5py
 import os
 import numpy as np
+import json
 import sys
 import argparse
+from multiprocessing import Pool
+from nibabel.arraywriters import make_array_writer, get_slope_inter
+from nibabel.minc2 import Minc2File
+from nibabel.openers import ImageOpener
+from nibabel.volumeutils import seek_tell
+from numpy.lib.stride_tricks import as_strided
+
+manifest_name = 'minc2nifti-manifest.json'
 
 # slightly modified version of _get_dimensions function 
 # obtained from  https://github.com/nipy/nibabel/blob/master/nibabel/minc2.py
@@ -14,54 +23,176 @@ def get_dimensions(var):
         return []
     return dimorder.split(',')
 
-def convert2nifti(in_folder, out_folder, dtype, gzip=False):
-    for mnc_block in os.listdir(in_folder):
+def read_block(minc_file, dtype, max_slab_bytes=64*1024**2):
+    """Return the scaled data of a MINC block, cast to dtype.
 
-        if mnc_block[-4:] != ".mnc":
-            continue
+    The data is read and scaled one slab of the slowest axis at a time, so
+    that the float64 array used for scaling is at most max_slab_bytes large.
+    """
+    shape = minc_file.get_data_shape()
+    data = np.empty(shape, dtype=dtype)
+
+    slice_bytes = np.dtype(np.float64).itemsize * int(np.prod(shape[1:]))
+    slab_slices = max(1, max_slab_bytes // slice_bytes)
+
+    for start in range(0, shape[0], slab_slices):
+        slab = (slice(start, min(start + slab_slices, shape[0])),)
+        data[slab] = minc_file.get_scaled_data(slab)
+
+    return data
+
+
+def stream_block(minc_file, nifti, nii_path, dtype, max_mem):
+    """Write the NIfTI header of nifti, then the scaled data of a MINC block slab by slab.
+
+    Slabs are taken along the last axis, which is the slowest axis of the
+    NIfTI data, so that they can be appended to the file in order. Each slab
+    holds as many slices as fit in max_mem bytes, counting the raw slab read
+    from HDF5, two float64 copies used for scaling and the cast slab. The
+    output is the same as saving nifti with its full data with nib.save.
+    """
+    shape = minc_file.get_data_shape()
+    out_dtype = nifti.get_data_dtype()
+
+    voxel_bytes = minc_file.get_data_dtype().itemsize + 2 * np.dtype(np.float64).itemsize + out_dtype.itemsize
+    slice_bytes = voxel_bytes * int(np.prod(shape[:-1]))
+    slab_slices = max(1, max_mem // slice_bytes)
+
+    # Same header preparation as nibabel's to_file_map
+    nifti.update_header()
+    header = nifti.header
+    arr_writer = make_array_writer(nifti.get_data(), out_dtype, header.has_data_slope, header.has_data_intercept)
+    header.set_slope_inter(*get_slope_inter(arr_writer))
 
-        filepath = os.path.join(in_folder, mnc_block)
-        block_header = h5py.File(filepath, 'r')
+    with ImageOpener(nii_path, 'wb') as nii:
+        header.write_to(nii)
+        seek_tell(nii, header.get_data_offset(), write0=True)
 
-        minc_part = block_header['minc-2.0']
-        # The whole image is the first of the entries in 'image'
-        image = minc_part['image']['0']
-        image_data = image['image']
-        dim_names = get_dimensions(image_data)
-        dimensions = minc_part['dimensions']
+        for start in range(0, shape[-1], slab_slices):
+            slab = (Ellipsis, slice(start, min(start + slab_slices, shape[-1])))
+            data = np.asfortranarray(minc_file.get_scaled_data(slab), dtype=out_dtype)
+            # the transpose of a Fortran-ordered array exposes its buffer in NIfTI order,
+            # viewed as bytes so that gzip counts the written size correctly
+            nii.write(data.T.reshape(-1).view(np.uint8))
 
-        dims = [dimensions[s].attrs.items() for s in dim_names]
 
-        ydim = dims[0][0][1]
-        zdim = dims[1][0][1]
-        xdim = dims[2][0][1]
+def convert_block(filepath, nii_path, dtype, max_mem=None):
+    block_header = h5py.File(filepath, 'r')
 
-        ystep = dims[0][11][1]
-        zstep = dims[1][10][1]
-        xstep = dims[2][10][1]
+    minc_part = block_header['minc-2.0']
+    # The whole image is the first of the entries in 'image'
+    image = minc_part['image']['0']
+    image_data = image['image']
+    dim_names = get_dimensions(image_data)
+    dimensions = minc_part['dimensions']
 
-        ystart = dims[0][12][1]
-        zstart = dims[1][11][1]
-        xstart = dims[2][11][1]
+    dims = [dimensions[s].attrs.items() for s in dim_names]
 
+    ydim = dims[0][0][1]
+    zdim = dims[1][0][1]
+    xdim = dims[2][0][1]
+
+    ystep = dims[0][11][1]
+    zstep = dims[1][10][1]
+    xstep = dims[2][10][1]
+
+    ystart = dims[0][12][1]
+    zstart = dims[1][11][1]
+    xstart = dims[2][11][1]
+
+
+    minc_file = Minc2File(block_header)
+    if max_mem is None:
+        data = read_block(minc_file, dtype)
+    else:
+        # A zero-strided array gives the image its shape and dtype without using memory
+        data = as_strided(np.zeros(1, dtype=dtype), shape=minc_file.get_data_shape(),
+                          strides=(0,) * len(minc_file.get_data_shape()))
+    nifti = nib.Nifti1Image(data, np.eye(4))
+
+    nifti.header['descrip'] =  '{0} {1} {2}'.format(ystart, zstart, xstart)
+
+    nifti.header['pixdim'][1] = ystep
+    nifti.header['pixdim'][2] = zstep
+    nifti.header['pixdim'][3] = xstep
+
+    print(nifti.header['pixdim'])
+
+    if max_mem is None:
+        nib.save(nifti, nii_path)
+    else:
+        stream_block(minc_file, nifti, nii_path, dtype, max_mem)
+    block_header.close()
+    return nii_path
 
-        data = nib.load(filepath).get_data().astype(dtype) 
-        nifti = nib.Nifti1Image(data, np.eye(4))
-        
-        nifti.header['descrip'] =  '{0} {1} {2}'.format(ystart, zstart, xstart)
-        
-        nifti.header['pixdim'][1] = ystep
-        nifti.header['pixdim'][2] = zstep
-        nifti.header['pixdim'][3] = xstep
 
-        print nifti.header['pixdim']
+def convert_job(job):
+    return convert_block(*job)
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path):
+    # Write then rename, so that an interrupted run never leaves a truncated manifest
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(manifest_path + '.tmp', manifest_path)
+
+
+def is_converted(manifest, nii_path):
+    """Return True if nii_path was written by a previous run and has not changed since."""
+    entry = manifest.get(os.path.basename(nii_path))
+    if entry is None or not os.path.exists(nii_path):
+        return False
+    stat = os.stat(nii_path)
+    return entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+
+
+def convert2nifti(in_folder, out_folder, dtype, gzip=False, jobs=1, max_mem=None):
+    """Convert the MINC blocks of in_folder to NIfTI blocks in out_folder.
+
+    Blocks are converted by a pool of jobs processes. The size and mtime of
+    every converted block are recorded in a manifest in out_folder, and
+    blocks already converted by a previous run are skipped.
+
+    If max_mem is given, blocks are streamed slab by slab instead of being
+    loaded whole, and the jobs together use about max_mem bytes of data.
+    """
+    manifest_path = os.path.join(out_folder, manifest_name)
+    manifest = load_manifest(manifest_path)
+
+    conversions = []
+    for mnc_block in sorted(os.listdir(in_folder)):
+
+        if mnc_block[-4:] != ".mnc":
+            continue
 
         nii_file = mnc_block[:-4] + '.nii'
-        
+
         if gzip:
             nii_file += '.gz'
-        
-        nib.save(nifti, os.path.join(out_folder, nii_file))
+
+        nii_path = os.path.join(out_folder, nii_file)
+        if is_converted(manifest, nii_path):
+            continue
+
+        conversions.append((os.path.join(in_folder, mnc_block), nii_path, dtype,
+                            None if max_mem is None else max_mem // jobs))
+
+    pool = Pool(jobs)
+    try:
+        for nii_path in pool.imap_unordered(convert_job, conversions):
+            stat = os.stat(nii_path)
+            manifest[os.path.basename(nii_path)] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+            save_manifest(manifest, manifest_path)
+    finally:
+        pool.close()
+        pool.join()
 
 
 if __name__ == '__main__':
@@ -73,6 +204,10 @@ if __name__ == '__main__':
                                                             (np.int16, np.uint16, np.float32,\
                                                             np.float64).")
     parser.add_argument('-gz', '--gzip', help="gzip file", action='store_false')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Number of blocks converted in parallel")
+    parser.add_argument('-m', '--max-mem', type=int, default=None,
+                        help="Stream blocks slab by slab, using at most MAX_MEM bytes of data over all jobs "
+                             "(default: load whole blocks)")
 
     args = parser.parse_args()
 
@@ -95,4 +230,4 @@ if __name__ == '__main__':
     
     gzip = args.gzip
     
-    convert2nifti(in_folder, out_folder, dtype, gzip)
+    convert2nifti(in_folder, out_folder, dtype, gzip, args.jobs, args.max_mem)
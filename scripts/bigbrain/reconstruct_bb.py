@@ -3,86 +3,632 @@ import os
 import h5py
 import numpy as np
 import math
+import resource
 import sys
 import argparse
+import io
+from collections import deque
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 from time import time
+from block_index import load_block_index
+import direct_io
+from coalesce import WritePlanner, merge_intervals
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disk-benchmarks'))
+import calibrate
+from io_trace import Tracer, TracedFile, open_image
+from merge_bb import image_header
 
 
-def reconstruct(legend_fn, reconstructed_fn, block_folder, block_prefix, block_suffix, bytes_per_voxel):
+def write_at(fd, buf, offset):
+    # os.write may return early on very large buffers, so loop until done
+    view = memoryview(np.ascontiguousarray(buf).reshape(-1).view(np.uint8))
+    while len(view) > 0:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, 0)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
 
-    legend = nib.load(legend_fn).get_data()
-    reconstructed_img = nib.load(reconstructed_fn)
 
+def write_columns(reconstructed, block_data, position, bb_shape, header_size, bytes_per_voxel):
+    """Write a block column by column, seeking before each column.
+
+    Returns the seek time and the number of seeks.
+    """
+    y_block, z_block, x_block = position
+    bb_ydim, bb_zdim, bb_xdim = bb_shape
+    ydim, zdim, xdim = block_data.shape
+
+    seek_time = 0
+    for i in range(0,xdim):
+        for j in range(0, zdim):
+            t = time()
+            reconstructed.seek(header_size + bytes_per_voxel*(y_block + (z_block + j)*bb_ydim +(x_block + i)*bb_ydim*bb_zdim), 0)
+            seek_time += time() - t
+            reconstructed.write(block_data[:, j,i].tobytes())
+
+    return seek_time, xdim * zdim
+
+
+class SparseColumnWriter(object):
+    """Write a block column by column as in columns mode, skipping the columns that are all zeros.
+
+    The reconstructed image must be zero-filled. The columns not written
+    are counted in skipped_columns and skipped_bytes.
+    """
+
+    def __init__(self):
+        self.skipped_columns = 0
+        self.skipped_bytes = 0
+
+    def __call__(self, reconstructed, block_data, position, bb_shape, header_size, bytes_per_voxel):
+        y_block, z_block, x_block = position
+        bb_ydim, bb_zdim, bb_xdim = bb_shape
+        ydim, zdim, xdim = block_data.shape
+
+        # one vectorized check of all the columns, in (x, z) order as in columns mode
+        nonzero = block_data.any(axis=0).T
+        self.skipped_columns += nonzero.size - int(nonzero.sum())
+        self.skipped_bytes += (nonzero.size - int(nonzero.sum())) * ydim * bytes_per_voxel
+
+        seek_time = 0
+        seek_number = 0
+        for i, j in zip(*np.nonzero(nonzero)):
+            t = time()
+            reconstructed.seek(header_size + bytes_per_voxel*(y_block + (z_block + j)*bb_ydim +(x_block + i)*bb_ydim*bb_zdim), 0)
+            seek_time += time() - t
+            reconstructed.write(block_data[:, j, i].tobytes())
+            seek_number += 1
+
+        return seek_time, seek_number
+
+
+def block_runs(block_data, position, bb_shape, header_size, bytes_per_voxel):
+    """Return the largest contiguous runs of the reconstructed image covered by a block.
+
+    A block spanning the full Y and Z dimensions is a single run of whole
+    x-planes. A block spanning the full Y dimension is one run per x-plane.
+    Otherwise, each column is a run. Runs are (offset, data) pairs, in
+    offset order, whose data are views on the block data.
+    """
+    y_block, z_block, x_block = position
+    bb_ydim, bb_zdim, bb_xdim = bb_shape
+    ydim, zdim, xdim = block_data.shape
+
+    data = np.asfortranarray(block_data)
+
+    def offset(y, z, x):
+        return header_size + bytes_per_voxel*(y + z*bb_ydim + x*bb_ydim*bb_zdim)
+
+    if ydim == bb_ydim and zdim == bb_zdim:
+        return [(offset(0, 0, x_block), data.reshape(-1, order='F'))]
+    if ydim == bb_ydim:
+        return [(offset(0, z_block, x_block + i), data[:, :, i].reshape(-1, order='F'))
+                for i in range(0, xdim)]
+    return [(offset(y_block, z_block + j, x_block + i), data[:, j, i])
+            for i in range(0, xdim) for j in range(0, zdim)]
+
+
+def run_offsets(block_shape, position, bb_shape, header_size, bytes_per_voxel):
+    """Return the offsets of the runs of block_runs, as an array, and the length of every run in bytes."""
+    y_block, z_block, x_block = position
+    bb_ydim, bb_zdim, bb_xdim = bb_shape
+    ydim, zdim, xdim = block_shape
+
+    x = np.arange(x_block, x_block + xdim, dtype=np.int64)
+    if ydim == bb_ydim and zdim == bb_zdim:
+        return np.array([header_size + bytes_per_voxel*x_block*bb_ydim*bb_zdim]), bytes_per_voxel*ydim*zdim*xdim
+    if ydim == bb_ydim:
+        return header_size + bytes_per_voxel*(z_block*bb_ydim + x*bb_ydim*bb_zdim), bytes_per_voxel*ydim*zdim
+    z = np.arange(z_block, z_block + zdim, dtype=np.int64)
+    return (header_size + bytes_per_voxel*(y_block + z[np.newaxis, :]*bb_ydim +
+                                           x[:, np.newaxis]*bb_ydim*bb_zdim)).reshape(-1), bytes_per_voxel*ydim
+
+
+def write_slabs(reconstructed, block_data, position, bb_shape, header_size, bytes_per_voxel):
+    """Write a block as the largest contiguous runs of the reconstructed image (see block_runs).
+
+    Runs are written with positioned writes, without seeking or copying.
+
+    Returns the seek time and the number of seeks (one per run).
+    """
+    runs = block_runs(block_data, position, bb_shape, header_size, bytes_per_voxel)
+
+    reconstructed.flush()
+    fd = reconstructed.fileno()
+    for run_offset, run in runs:
+        write_at(fd, run, run_offset)
+
+    return 0, len(runs)
+
+
+class DirectWriter(object):
+    """Write blocks with O_DIRECT, bypassing the page cache.
+
+    O_DIRECT only transfers whole aligned pages, so the runs of a block (see
+    block_runs) are grouped into segments of adjacent pages of at most
+    segment_bytes. Each segment is read into an aligned buffer, patched with
+    its runs and written back. Where O_DIRECT is not supported, runs are
+    written as in slabs mode and the written pages are dropped from the page
+    cache after each block.
+
+    Seeks are counted as in slabs mode, one per run.
+    """
+
+    def __init__(self, reconstructed_fn, segment_bytes=64*1024**2):
+        self.fd, self.direct = direct_io.open_direct(reconstructed_fn, os.O_RDWR)
+        self.file = io.FileIO(self.fd, 'r+')
+        self.size = os.fstat(self.fd).st_size
+        self.buffer = direct_io.aligned_buffer(segment_bytes)
+
+    def __call__(self, reconstructed, block_data, position, bb_shape, header_size, bytes_per_voxel):
+        runs = block_runs(block_data, position, bb_shape, header_size, bytes_per_voxel)
+
+        if not self.direct:
+            for run_offset, run in runs:
+                write_at(self.fd, run, run_offset)
+            direct_io.drop_cache(self.fd)
+            return 0, len(runs)
+
+        for start, end, pieces in direct_io.segments(runs, len(self.buffer)):
+            segment = self.buffer[:end - start]
+            direct_io.read_at(self.file, segment, start)
+            for piece_offset, piece in pieces:
+                segment[piece_offset - start:piece_offset - start + len(piece)] = piece
+            direct_io.write_at(self.file, segment, start)
+
+        return 0, len(runs)
+
+    def flush(self):
+        # the last segment may extend past the end of the image
+        os.ftruncate(self.fd, self.size)
+        self.file.close()
+
+
+class MmapWriter(object):
+    """Write blocks into a memory map of the reconstructed image.
+
+    Each block is copied with a single slice assignment. Dirty pages are
+    flushed and released once flush_bytes bytes have been copied, which
+    bounds the page cache used by the reconstruction. A flush_bytes of 0
+    only flushes when the reconstruction ends.
+    """
+
+    def __init__(self, reconstructed_fn, header_size, dtype, bb_shape, flush_bytes=0):
+        self.image = np.memmap(reconstructed_fn, dtype=dtype, mode='r+', offset=header_size,
+                               shape=bb_shape, order='F')
+        self.flush_bytes = flush_bytes
+        self.dirty_bytes = 0
+        self.warned = False
+
+    def __call__(self, reconstructed, block_data, position, bb_shape, header_size, bytes_per_voxel):
+        y_block, z_block, x_block = position
+        ydim, zdim, xdim = block_data.shape
+
+        self.image[y_block:y_block + ydim, z_block:z_block + zdim, x_block:x_block + xdim] = block_data
+        self.dirty_bytes += block_data.nbytes
+
+        if self.flush_bytes and self.dirty_bytes >= self.flush_bytes:
+            self.flush()
+
+        return 0, 0
+
+    def flush(self):
+        self.image.flush()
+        released = direct_io.madvise_dontneed(self.image._mmap)
+        with open(self.image.filename, 'rb') as f:
+            released = direct_io.fadvise_dontneed(f.fileno()) and released
+        if not released and not self.warned:
+            print('WARNING: pages cannot be released on this OS, flushing only writes them')
+            self.warned = True
+        self.dirty_bytes = 0
+
+
+# maximum number of buffers of a pwritev call
+try:
+    iov_max = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    iov_max = 1024
+
+
+def read_gap(fd, nbytes, offset):
+    """Return nbytes of the file from offset, as a uint8 array."""
+    gap = np.empty(nbytes, dtype=np.uint8)
+    pos = 0
+    while pos < nbytes:
+        if hasattr(os, 'pread'):
+            data = os.pread(fd, nbytes - pos, offset + pos)
+        else:
+            os.lseek(fd, offset + pos, 0)
+            data = os.read(fd, nbytes - pos)
+        if not data:
+            raise IOError('unexpected end of file at offset {0}'.format(offset + pos))
+        gap[pos:pos + len(data)] = np.frombuffer(data, dtype=np.uint8)
+        pos += len(data)
+    return gap
+
+
+def write_gathered(fd, pieces, offset):
+    """Write pieces, which are contiguous in the file, from offset.
+
+    With pwritev (Python 3.7), up to iov_max pieces are written by each
+    system call, without copying them together. Otherwise each piece is
+    written on its own, still without seeking in between.
+    """
+    if len(pieces) == 1 or not hasattr(os, 'pwritev'):
+        for piece in pieces:
+            write_at(fd, piece, offset)
+            offset += len(piece)
+        return
 
-    ystart_0 = 0
-    zstart_0 = 0
-    xstart_0 = 0
+    pieces = deque(memoryview(piece) for piece in pieces)
+    while pieces:
+        written = os.pwritev(fd, list(islice(pieces, 0, iov_max)), offset)
+        offset += written
+        # a short write stops anywhere, even inside a piece
+        while written:
+            if written >= len(pieces[0]):
+                written -= len(pieces.popleft())
+            else:
+                pieces[0] = pieces[0][written:]
+                written = 0
 
-    blocks_copied =  {}
+
+class ArenaWriter(object):
+    """Clustered writes of blocks through one arena of arena_bytes allocated up front.
+
+    The runs of each block (see block_runs) are copied into the next free
+    bytes of the arena, and an extent table records the image offset, arena
+    offset and length of each. An extent that continues the previous one in
+    the image and in the arena extends it. When a block does not fit, the
+    arena is flushed: extents are sorted by image offset, and each range of
+    contiguous image bytes is written at once (see write_gathered), straight
+    from the arena. Blocks larger than the arena are written as in slabs mode.
+
+    With a device profile (see calibrate.py), a WritePlanner decides for
+    each gap between two ranges whether to seek over it, or to fill it, with
+    zeros on a fresh image or with the bytes read from the image, and write
+    the ranges and the gap at once (see coalesce.py).
+
+    Seeks are counted once per run written, and once per read of the gaps
+    of a run.
+    """
+
+    def __init__(self, reconstructed_fn, arena_bytes=1024**3, profile=None, fresh=False):
+        self.fd = os.open(reconstructed_fn, os.O_RDWR)
+        self.arena = direct_io.aligned_buffer(arena_bytes)[:arena_bytes]
+        self.used = 0
+        # image offset, arena offset, length; grown when full
+        self.extents = np.zeros((1024, 3), dtype=np.int64)
+        self.count = 0
+        self.planner = WritePlanner(profile, fresh) if profile else None
+        self.filled_gaps = 0
+        self.filled_bytes = 0
+
+    def __call__(self, reconstructed, block_data, position, bb_shape, header_size, bytes_per_voxel):
+        seek_number = 0
+        if self.used + block_data.nbytes > len(self.arena):
+            seek_number += self.write_extents()
+        if block_data.nbytes > len(self.arena):
+            runs = block_runs(block_data, position, bb_shape, header_size, bytes_per_voxel)
+            for run_offset, run in runs:
+                write_at(self.fd, run, run_offset)
+            if self.planner:
+                offsets = np.array([run_offset for run_offset, run in runs], dtype=np.int64)
+                self.planner.written(offsets, offsets + np.array([run.nbytes for run_offset, run in runs]))
+            return 0, seek_number + len(runs)
+
+        # the runs of a block are its data in Fortran order: one copy into the arena
+        self.arena[self.used:self.used + block_data.nbytes] = \
+            np.asfortranarray(block_data).reshape(-1, order='F').view(np.uint8)
+        offsets, run_bytes = run_offsets(block_data.shape, position, bb_shape, header_size, bytes_per_voxel)
+
+        # runs continuing the previous one, in the image and thus in the arena, extend its extent
+        continued = np.zeros(len(offsets), dtype=bool)
+        continued[1:] = offsets[1:] == offsets[:-1] + run_bytes
+        if self.count:
+            last = self.extents[self.count - 1]
+            continued[0] = last[0] + last[2] == offsets[0] and last[1] + last[2] == self.used
+        starts = np.flatnonzero(~continued)
+        lengths = np.diff(np.concatenate([starts, [len(offsets)]])) * run_bytes
+        if continued[0]:
+            first_run = starts[0] if len(starts) else len(offsets)
+            self.extents[self.count - 1, 2] += first_run * run_bytes
+
+        if self.count + len(starts) > len(self.extents):
+            grown = np.zeros((max(2 * len(self.extents), self.count + len(starts)), 3), dtype=np.int64)
+            grown[:self.count] = self.extents[:self.count]
+            self.extents = grown
+        new = self.extents[self.count:self.count + len(starts)]
+        new[:, 0] = offsets[starts]
+        new[:, 1] = self.used + starts * run_bytes
+        new[:, 2] = lengths
+        self.count += len(starts)
+        self.used += block_data.nbytes
+
+        return 0, seek_number
+
+    def write_extents(self):
+        """Write the arena, and return the number of seeks: runs written and gaps read."""
+        if not self.count:
+            return 0
+        extents = self.extents[:self.count]
+        extents = extents[np.argsort(extents[:, 0], kind='mergesort')]
+        # ranges of contiguous extents
+        bounds = np.concatenate([[0], np.flatnonzero(extents[1:, 0] != extents[:-1, 0] + extents[:-1, 2]) + 1,
+                                 [len(extents)]])
+        range_starts = extents[bounds[:-1], 0]
+        range_ends = extents[bounds[1:] - 1, 0] + extents[bounds[1:] - 1, 2]
+
+        fill = np.zeros(len(range_starts) - 1, dtype=bool)
+        zero = fill
+        if self.planner:
+            fill, zero = self.planner.plan(range_starts, range_ends)
+        gaps = range_starts[1:] - range_ends[:-1]
+        zeros = np.zeros(int(gaps[zero].max()) if zero.any() else 0, dtype=np.uint8)
+
+        # runs of ranges joined by filled gaps
+        run_bounds = np.concatenate([[0], np.flatnonzero(~fill) + 1, [len(range_starts)]])
+        seek_number = len(run_bounds) - 1
+        for first, end in zip(run_bounds[:-1], run_bounds[1:]):
+            # the gaps of the run to be read are read at once, from the first to the last
+            read = np.flatnonzero(fill[first:end - 1] & ~zero[first:end - 1]) + first
+            if len(read):
+                span_start = int(range_ends[read[0]])
+                span = read_gap(self.fd, int(range_starts[read[-1] + 1]) - span_start, span_start)
+                seek_number += 1
+            pieces = []
+            for i in range(first, end):
+                if i > first and zero[i - 1]:
+                    pieces.append(zeros[:gaps[i - 1]])
+                elif i > first:
+                    pieces.append(span[range_ends[i - 1] - span_start:range_starts[i] - span_start])
+                pieces.extend(self.arena[a:a + length] for image_offset, a, length in extents[bounds[i]:bounds[i + 1]])
+            write_gathered(self.fd, pieces, range_starts[first])
+
+        self.filled_gaps += int(fill.sum())
+        self.filled_bytes += int(gaps[fill].sum())
+        if self.planner:
+            self.planner.written(range_starts[run_bounds[:-1]], range_ends[run_bounds[1:] - 1])
+        self.used = 0
+        self.count = 0
+        return seek_number
+
+    def flush(self):
+        seek_number = self.write_extents()
+        os.close(self.fd)
+        return seek_number
+
+
+write_modes = {
+    'columns': write_columns,
+    'slabs': write_slabs,
+    'mmap': MmapWriter,
+    'direct': DirectWriter,
+    'arena': ArenaWriter
+}
+
+
+def create_sparse_image(reconstructed_fn, bb_shape, dtype):
+    """Create a zero-filled image as a sparse file: only its header is written."""
+    header = image_header(bb_shape, dtype)
+    with open(reconstructed_fn, 'wb') as f:
+        f.write(header)
+        f.truncate(len(header) + int(np.prod(bb_shape)) * np.dtype(dtype).itemsize)
+
+
+def punch_blocks(reconstructed_fn, blocks, bb_shape, header_size, bytes_per_voxel):
+    """Deallocate the zero blocks of the reconstructed image (see direct_io.punch_hole).
+
+    The runs of the blocks are merged into contiguous ranges, of which the
+    whole pages are deallocated. Returns the bytes deallocated, or None if
+    holes cannot be punched.
+    """
+    runs = [run_offsets(block[2], block[1], bb_shape, header_size, bytes_per_voxel) for block in blocks]
+    starts = np.concatenate([offsets for offsets, length in runs]).astype(np.int64)
+    ends = np.concatenate([offsets + length for offsets, length in runs]).astype(np.int64)
+    starts, ends = merge_intervals(starts, ends)
+    # the bytes of partial pages are zeros already
+    starts, ends = direct_io.align_up(starts), direct_io.align_down(ends)
+    whole = ends > starts
+
+    punched = 0
+    fd = os.open(reconstructed_fn, os.O_WRONLY)
+    try:
+        for start, end in zip(starts[whole], ends[whole]):
+            if not direct_io.punch_hole(fd, int(start), int(end - start)):
+                return None
+            punched += int(end - start)
+    finally:
+        os.close(fd)
+    return punched
+
+
+def decode_block(block_filename, tracer=None, uncached=False):
+    t = time()
+    if uncached:
+        # read from the device, and do not leave the block cached
+        direct_io.drop_file_cache(block_filename)
+    if tracer:
+        img, f = open_image(block_filename, tracer)
+        try:
+            block_data = img.get_data()
+        finally:
+            f.close()
+    else:
+        # uncached blocks are read at once rather than memory-mapped, to be dropped after
+        block_data = nib.load(block_filename, mmap=not uncached).get_data()
+    if uncached:
+        direct_io.drop_file_cache(block_filename)
+    return block_data, time() - t
+
+
+def decoded_blocks(blocks, decode_jobs=0, queue_bytes=0, tracer=None, uncached=False):
+    """Yield (block, block_data, decode_time) for each block, in order.
+
+    With decode_jobs > 0, blocks are decoded ahead by a pool of threads
+    while the caller writes the previous ones. Decoding stops getting ahead
+    once the decoded blocks waiting to be written, including the one being
+    written, would exceed queue_bytes. At least one block is always decoded.
+    If uncached, blocks are dropped from the page cache before and after
+    they are read (see direct_io.drop_file_cache).
+    """
+    if decode_jobs == 0:
+        for block in blocks:
+            block_data, decode_time = decode_block(block[0], tracer, uncached)
+            yield block, block_data, decode_time
+        return
+
+    pool = ThreadPool(decode_jobs)
+    pending = deque()
+    queued_bytes = 0
+    next_block = 0
+
+    try:
+        while pending or next_block < len(blocks):
+            while next_block < len(blocks) and \
+                    (not pending or queued_bytes + blocks[next_block][3] <= queue_bytes):
+                block = blocks[next_block]
+                pending.append((block, pool.apply_async(decode_block, (block[0], tracer, uncached))))
+                queued_bytes += block[3]
+                next_block += 1
+
+            block, result = pending.popleft()
+            block_data, decode_time = result.get()
+            yield block, block_data, decode_time
+            queued_bytes -= block[3]
+    finally:
+        pool.terminate()
+
+
+def reconstruct(legend_fn, reconstructed_fn, block_folder, block_prefix, block_suffix, bytes_per_voxel,
+                mode='columns', flush_bytes=0, decode_jobs=0, queue_bytes=0, index_jobs=None, tracer=None,
+                arena_bytes=1024**3, profile=None, fresh=False, sparse=False, punch=False, benchmark=False):
+    """Write the blocks of a legend into the zero-filled image reconstructed_fn.
+
+    In direct mode, neither the blocks read nor the image written are left in
+    the page cache. Zero blocks of sparse splits (see block_index.py) are
+    never read nor written. If sparse, blocks that are all zeros are not written either, and
+    in columns mode neither are the columns of a block that are all zeros.
+    If punch, the runs of the zero blocks are deallocated from the image,
+    e.g. to make a template written with zeros sparse.
+    """
+
+    reconstructed_img = nib.load(reconstructed_fn)
 
     bb_header = reconstructed_img.header
 
     try:
       header_size = bb_header.single_vox_offset
     except:
-      print 'ERROR: File not a NIfTI image'
+      print('ERROR: File not a NIfTI image')
       sys.exit(1)
 
     bb_ydim = bb_header.get_data_shape()[0]
     bb_zdim = bb_header.get_data_shape()[1]
     bb_xdim = bb_header.get_data_shape()[2]
 
+    if mode == 'mmap':
+        write_block = MmapWriter(reconstructed_fn, header_size, bb_header.get_data_dtype(),
+                                 (bb_ydim, bb_zdim, bb_xdim), flush_bytes)
+    elif mode == 'direct':
+        write_block = DirectWriter(reconstructed_fn)
+    elif mode == 'arena':
+        write_block = ArenaWriter(reconstructed_fn, arena_bytes, profile, fresh)
+    elif sparse and mode == 'columns':
+        write_block = SparseColumnWriter()
+    else:
+        write_block = write_modes[mode]
+
+    total_read_time = 0
+    total_decode_time = 0
+    total_write_time = 0
+    total_seek_time = 0
+    total_seek_number = 0
+
+    # The block index gives the position of every block, sorted by offset in
+    # the reconstructed image, which minimizes seeks
+    t = time()
+    index = load_block_index(legend_fn, block_folder, block_prefix, block_suffix, index_jobs)
+    blocks = [(str(path), tuple(int(p) for p in position), tuple(int(d) for d in shape),
+               int(np.prod(shape)) * np.dtype(dtype).itemsize)
+              for path, position, shape, dtype in zip(index['path'], index['position'],
+                                                      index['shape'], index['dtype'])]
+    # zero blocks of sparse splits have no file, and the image is zero-filled
+    zero_blocks = [block for block, zero in zip(blocks, index['zero']) if zero]
+    blocks = [block for block, zero in zip(blocks, index['zero']) if not zero]
+    legend_zero_blocks = len(zero_blocks)
+    total_read_time += time() - t
+    total_check_time = 0
+
     with open(reconstructed_fn, "r+b") as reconstructed:
-        for x in range(0, legend.shape[2]):
-            for y in range(0, legend.shape[0]):
-                for z in range(0, legend.shape[1]):
-                   
-                    block_num = str(int(legend[y][z][x])).zfill(3) 
-                    
-                    block_filename = '{0}-0{1}-{2}'.format(os.path.join(block_folder,block_prefix), block_num, block_suffix)
-                    
-                    if block_num in blocks_copied:
-                        continue
-                    else:
-                        blocks_copied[block_num] = 1
-
-                    block_img = nib.load(block_filename)
-                    header = block_img.header
-                    shape = header.get_data_shape()
-                    ydim = shape[0]
-                    zdim = shape[1]
-                    xdim = shape[2]
-
-                    block_data = block_img.get_data()
-
-                    start = header['descrip'].tostring().strip('\x00').split()
-                    step = header['pixdim']
-
-                    ystep = round(float(step[1]), 2)
-                    zstep = round(float(step[2]), 2)
-                    xstep = round(float(step[3]), 2)
-                   
-
-                    ystart = float(start[0].strip())
-                    zstart = float(start[1].strip())
-                    xstart = float(start[2].strip())
-
-                    #get first block's start values to compare position with other blocks
-                    if y == 0 and z == 0 and x == 0 :
-                        ystart_0 = ystart
-                        zstart_0 = zstart
-                        xstart_0 = xstart
-
-                    y_block = int(abs((ystart-ystart_0)/ystep))
-                    z_block = int(abs((zstart-zstart_0)/zstep))
-                    x_block = int(abs((xstart-xstart_0)/xstep))
-
-                    for i in range(0,xdim):
-                        for j in range(0, zdim):
-                            reconstructed.seek(header_size + bytes_per_voxel*(y_block + (z_block + j)*bb_ydim +(x_block + i)*bb_ydim*bb_zdim), 0)
-                            reconstructed.write(block_data[:, j,i].tobytes())
-                            
-                     
+        if tracer:
+            # only the columns mode writes through the file object
+            reconstructed = TracedFile(reconstructed, tracer, os.path.abspath(reconstructed_fn))
+        t = time()
+        for block, block_data, decode_time in decoded_blocks(blocks, decode_jobs, queue_bytes, tracer,
+                                                                   uncached=mode == 'direct'):
+            total_read_time += time() - t
+            total_decode_time += decode_time
+
+            if sparse:
+                t = time()
+                zero = not block_data.any()
+                total_check_time += time() - t
+                if zero:
+                    zero_blocks.append(block)
+                    t = time()
+                    continue
+
+            t = time()
+            seek_time, seek_number = write_block(reconstructed, block_data, block[1],
+                                                 (bb_ydim, bb_zdim, bb_xdim),
+                                                 header_size, bytes_per_voxel)
+            total_write_time += time() - t - seek_time
+            total_seek_time += seek_time
+            total_seek_number += seek_number
+            t = time()
+
+    if mode in ('mmap', 'direct', 'arena'):
+        t = time()
+        total_seek_number += write_block.flush() or 0
+        total_write_time += time() - t
+
+    punched = 0
+    if punch and zero_blocks:
+        t = time()
+        punched = punch_blocks(reconstructed_fn, zero_blocks, (bb_ydim, bb_zdim, bb_xdim), header_size,
+                               bytes_per_voxel)
+        total_write_time += time() - t
+
+    if benchmark:
+        # ru_maxrss is in kilobytes on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        print('decode time: {0}s (summed over {1} decode threads), read wait time: {2}s, '
+              'write time: {3}s, peak RSS: {4} bytes'.format(total_decode_time, decode_jobs,
+                                                             total_read_time, total_write_time + total_seek_time,
+                                                             peak_rss))
+        if mode == 'arena':
+            print('gaps filled instead of seeking: {0} ({1} bytes)'.format(write_block.filled_gaps,
+                                                                          write_block.filled_bytes))
+        if sparse or zero_blocks:
+            # blocks holds the blocks read, including those found to be all zeros
+            total_bytes = sum(block[3] for block in blocks + zero_blocks[:legend_zero_blocks])
+            skipped_bytes = sum(block[3] for block in zero_blocks) + getattr(write_block, 'skipped_bytes', 0)
+            written_bytes = total_bytes - skipped_bytes
+            # at the throughput of the bytes written
+            saved_time = skipped_bytes * total_write_time / written_bytes if written_bytes else 0
+            print('zero blocks not written: {0} ({1} listed in the legend), zero columns not written: {2}, '
+                  'bytes not written: {3}, zero check time: {4}s, estimated write time saved: {5}s'.format(
+                      len(zero_blocks), legend_zero_blocks, getattr(write_block, 'skipped_columns', 0),
+                      skipped_bytes, total_check_time, saved_time))
+            if punch:
+                print('bytes deallocated: {0}'.format(punched) if punched is not None
+                      else 'holes cannot be punched on this file system')
+        return total_read_time, total_write_time, total_seek_time, total_seek_number
 
 if __name__ == "__main__":
 
@@ -99,6 +645,42 @@ if __name__ == "__main__":
     parser.add_argument('dtype', type=str, help="Numpy datatype \
                                                             (np.int16, np.ushort, np.uint16, np.float32,\
                                                             np.float64).")
+    parser.add_argument('-m', '--mode', choices=sorted(write_modes.keys()), default='columns',
+                        help="Write each block column by column (default), as contiguous runs of slabs, "
+                             "through a memory map of the reconstructed image, with O_DIRECT and blocks read "
+                             "uncached, or through "
+                             "an arena of ARENA_BYTES flushed as sorted contiguous ranges")
+    parser.add_argument('-a', '--arena-bytes', type=int, default=1024**3,
+                        help="arena mode only: size of the arena, in bytes")
+    parser.add_argument('-p', '--profile', type=str, default=None,
+                        help="arena mode only: device profile written by calibrate.py, to fill the gaps "
+                             "between written ranges when it is faster than seeking")
+    parser.add_argument('--fresh', action='store_true',
+                        help="arena mode only: the reconstructed image is zero-filled, so that gaps never "
+                             "written can be filled with zeros instead of being read")
+    parser.add_argument('-s', '--sparse', action='store_true',
+                        help="Do not write the blocks that are all zeros, nor in columns mode the columns that "
+                             "are all zeros")
+    parser.add_argument('--punch', action='store_true',
+                        help="Deallocate the zero blocks from the reconstructed image (fallocate), e.g. to make a "
+                             "template written with zeros sparse")
+    parser.add_argument('--create', action='store_true',
+                        help="Create the reconstructed image as a sparse zero-filled file, instead of using a "
+                             "template")
+    parser.add_argument('-f', '--flush-bytes', type=int, default=0,
+                        help="mmap mode only: flush and release dirty pages every FLUSH_BYTES bytes "
+                             "(default: only at the end)")
+    parser.add_argument('-j', '--decode-jobs', type=int, default=0,
+                        help="Number of threads decoding blocks ahead of the writer (default: decode serially)")
+    parser.add_argument('-q', '--queue-bytes', type=int, default=4*1024**3,
+                        help="Maximum size of the decoded blocks held in memory with --decode-jobs, in bytes")
+    parser.add_argument('-i', '--index-jobs', type=int, default=None,
+                        help="Number of processes reading block headers when building the block index "
+                             "(default: one per CPU)")
+    parser.add_argument('--trace', type=str, default=None,
+                        help="Trace every read of the blocks, and in columns mode every seek and write of the "
+                             "reconstructed image, to this file (summary: python io_trace.py TRACE)")
+    parser.add_argument('-b', '--benchmark', action='store_true', help="Print seek count and timings")
 
     args = parser.parse_args()
 
@@ -122,4 +704,26 @@ if __name__ == "__main__":
     else:
         bytes_per_voxel = np.dtype(np.float64).itemsize
 
-    reconstruct(legend, reconstructed_fn, block_folder, block_prefix, block_suffix, bytes_per_voxel)
+    tracer = Tracer(args.trace) if args.trace else None
+
+    if args.create:
+        index = load_block_index(legend, block_folder, block_prefix, block_suffix, args.index_jobs)
+        create_sparse_image(reconstructed_fn, tuple(int(d) for d in (index['position'] + index['shape']).max(axis=0)),
+                            np.dtype(str(index['dtype'][0])))
+
+    s_time = time()
+    stats = reconstruct(legend, reconstructed_fn, block_folder, block_prefix, block_suffix, bytes_per_voxel,
+                        mode=args.mode, flush_bytes=args.flush_bytes,
+                        decode_jobs=args.decode_jobs, queue_bytes=args.queue_bytes,
+                        index_jobs=args.index_jobs, tracer=tracer,
+                        arena_bytes=args.arena_bytes,
+                        profile=calibrate.load_profile(args.profile) if args.profile else None,
+                        fresh=args.fresh, sparse=args.sparse, punch=args.punch, benchmark=args.benchmark)
+    total_time = time() - s_time
+
+    if tracer:
+        tracer.close()
+
+    if args.benchmark:
+        # (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time)
+        print(' '.join(str(e) for e in stats + (total_time,)))
@@ -0,0 +1,229 @@
+import nibabel as nib
+import numpy as np
+import argparse
+import numbers
+from collections import OrderedDict
+from time import time
+from block_index import load_block_index
+
+# Read-only view of the reconstructed image, served from its blocks without
+# merging them. A VirtualImage is built from the block index of a legend and
+# sliced like a numpy array, in (y, z, x) order: a read only touches the
+# blocks that overlap the slices, and only reads their part of each block,
+# through the block's array proxy. The cost of a read is therefore that of
+# the region of interest, not of the image.
+#
+# Decoded block regions are kept in an LRU cache bounded in bytes. A later
+# read of the same block region, or of a region within it (e.g. zooming in),
+# is served from the cache. This matters most for gzipped blocks, whose
+# regions are decompressed from the start of the block.
+
+
+def normalize_key(key, shape):
+    """Return the (start, stop, step) of every axis selected by key, and the axes indexed by an integer.
+
+    Integers, slices and Ellipsis are supported, as in numpy basic indexing.
+    Starts and stops are those of slice.indices, stops are exclusive.
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+    ellipsis = [i for i, k in enumerate(key) if k is Ellipsis]
+    if len(ellipsis) > 1:
+        raise IndexError('an index can only have a single ellipsis')
+    if ellipsis:
+        i = ellipsis[0]
+        key = key[:i] + (slice(None),) * (len(shape) - len(key) + 1) + key[i + 1:]
+    if len(key) > len(shape):
+        raise IndexError('too many indices: {0} for {1} dimensions'.format(len(key), len(shape)))
+    key = key + (slice(None),) * (len(shape) - len(key))
+
+    slices = []
+    dropped = []
+    for axis, (k, dim) in enumerate(zip(key, shape)):
+        if isinstance(k, slice):
+            slices.append(k.indices(dim))
+        elif isinstance(k, numbers.Integral):
+            k = int(k)
+            if not -dim <= k < dim:
+                raise IndexError('index {0} is out of bounds for axis {1} with size {2}'.format(k, axis, dim))
+            k = k + dim if k < 0 else k
+            slices.append((k, k + 1, 1))
+            dropped.append(axis)
+        else:
+            raise TypeError('only integers, slices and Ellipsis are supported, not {0}'.format(type(k).__name__))
+    return slices, dropped
+
+
+def axis_selection(coords, start, length):
+    """Return the range of indices of coords that fall in [start, start + length), and the ascending slice
+    of these coordinates relative to start, or None if no coordinate falls in it. coords is an arithmetic
+    progression, so the range is contiguous."""
+    selected = np.flatnonzero((coords >= start) & (coords < start + length))
+    if not len(selected):
+        return None
+    first, last = coords[selected[0]] - start, coords[selected[-1]] - start
+    step = abs(int(coords[1] - coords[0])) if len(coords) > 1 else 1
+    low, high = min(first, last), max(first, last)
+    return (selected[0], selected[-1] + 1), (int(low), int(high) + 1, step)
+
+
+def contained(inner, outer):
+    """Return the slices of the region outer that select the region inner, or None if it is not in it.
+
+    Regions are (start, stop, step) per axis, with ascending steps.
+    """
+    slices = []
+    for (start, stop, step), (outer_start, outer_stop, outer_step) in zip(inner, outer):
+        if start < outer_start or stop > outer_stop or (start - outer_start) % outer_step or step % outer_step:
+            return None
+        count = len(range(start, stop, step))
+        first = (start - outer_start) // outer_step
+        slices.append(slice(first, first + (count - 1) * (step // outer_step) + 1, step // outer_step))
+    return tuple(slices)
+
+
+class RegionCache(object):
+    """LRU cache of decoded block regions, bounded in bytes.
+
+    Regions are keyed by block and (start, stop, step) per axis. Regions
+    larger than the cache are not cached.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.regions = OrderedDict()
+        # cached regions of each block, to find a region containing another
+        self.block_regions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, block, region):
+        """Return the cached data of region, read from a cached region of block containing it, or None."""
+        for cached in self.block_regions.get(block, ()):
+            slices = contained(region, cached)
+            if slices is not None:
+                data = self.regions.pop((block, cached))
+                # most recently used last
+                self.regions[(block, cached)] = data
+                self.hits += 1
+                return data[slices]
+        self.misses += 1
+        return None
+
+    def put(self, block, region, data):
+        if data.nbytes > self.max_bytes:
+            return
+        while self.regions and self.nbytes + data.nbytes > self.max_bytes:
+            (evicted_block, evicted), evicted_data = self.regions.popitem(last=False)
+            self.nbytes -= evicted_data.nbytes
+            self.block_regions[evicted_block].remove(evicted)
+            if not self.block_regions[evicted_block]:
+                del self.block_regions[evicted_block]
+        self.regions[(block, region)] = data
+        self.block_regions.setdefault(block, []).append(region)
+        self.nbytes += data.nbytes
+
+
+class VirtualImage(object):
+    """Read-only image of a legend's blocks, indexed like a numpy array in (y, z, x) order.
+
+    block_folder, block_prefix and block_suffix are only needed for legend
+    images. cache_bytes bounds the decoded block regions kept for later
+    reads.
+    """
+
+    def __init__(self, legend_fn, block_folder='', block_prefix='', block_suffix='', cache_bytes=1024**3):
+        self.index = load_block_index(legend_fn, block_folder, block_prefix, block_suffix)
+        self.position = self.index['position']
+        self.block_shape = self.index['shape']
+        self.shape = tuple(int(d) for d in (self.position + self.block_shape).max(axis=0))
+        self.dtype = np.dtype(str(self.index['dtype'][0]))
+        self.cache = RegionCache(cache_bytes)
+        self.proxies = {}
+        self.blocks_read = 0
+        self.bytes_read = 0
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def proxy(self, block):
+        if block not in self.proxies:
+            self.proxies[block] = nib.load(str(self.index['path'][block])).dataobj
+        return self.proxies[block]
+
+    def read_region(self, block, region):
+        """Return the data of region of a block, from the cache or read through its array proxy."""
+        data = self.cache.get(block, region)
+        if data is None:
+            data = np.asarray(self.proxy(block)[tuple(slice(*s) for s in region)])
+            self.blocks_read += 1
+            self.bytes_read += data.nbytes
+            self.cache.put(block, region, data)
+        return data
+
+    def __getitem__(self, key):
+        slices, dropped = normalize_key(key, self.shape)
+        coords = [np.arange(*s) for s in slices]
+        out = np.zeros(tuple(len(c) for c in coords), dtype=self.dtype)
+
+        if out.size:
+            low = np.array([c.min() for c in coords])
+            high = np.array([c.max() + 1 for c in coords])
+            # zero blocks of sparse splits have no file, and out is zeros already
+            overlapping = np.flatnonzero(((self.position < high) & (self.position + self.block_shape > low)).all(axis=1) &
+                                         ~self.index['zero'])
+            # descending slices are read in ascending order, then reversed
+            reverse = tuple(slice(None, None, -1 if s[2] < 0 else 1) for s in slices)
+            for block in overlapping:
+                selections = [axis_selection(c, start, length)
+                              for c, start, length in zip(coords, self.position[block], self.block_shape[block])]
+                # with steps, the slices may skip a block within their bounds
+                if any(selection is None for selection in selections):
+                    continue
+                data = self.read_region(block, tuple(region for out_range, region in selections))
+                out[tuple(slice(*out_range) for out_range, region in selections)] = data[reverse]
+
+        return out.reshape(tuple(len(c) for axis, c in enumerate(coords) if axis not in dropped))
+
+    def cache_info(self):
+        """Return the cache hits and misses, the bytes cached, and the blocks and bytes read so far."""
+        return {'hits': self.cache.hits, 'misses': self.cache.misses, 'cached_bytes': self.cache.nbytes,
+                'blocks_read': self.blocks_read, 'bytes_read': self.bytes_read}
+
+
+if __name__ == "__main__":
+
+    # sample command: python virtual_image.py /data/blocks125/legend.txt /data/roi.nii -r 0 385 100 200 1000 1100
+
+    parser = argparse.ArgumentParser(description='Extract a region of interest of the reconstructed image '
+                                                 'from its blocks, without merging them')
+    parser.add_argument('legend', type=str, help="The legend image or legend.txt of the blocks")
+    parser.add_argument('output', type=str, help="The region of interest image")
+    parser.add_argument('-r', '--roi', type=int, nargs=6, required=True, metavar=('Y0', 'Y1', 'Z0', 'Z1', 'X0', 'X1'),
+                        help="First and last + 1 voxels of the region of interest along y, z and x")
+    parser.add_argument('--blockfldr', type=str, default='', help="Legend images only: the folder containing the blocks")
+    parser.add_argument('--blockprfx', type=str, default='', help="Legend images only: the block name prefix")
+    parser.add_argument('--blocksffx', type=str, default='', help="Legend images only: the block name suffix")
+    parser.add_argument('-c', '--cache-bytes', type=int, default=1024**3,
+                        help="Maximum bytes of decoded block regions cached")
+    parser.add_argument('-b', '--benchmark', action='store_true', help="Print blocks read and timings")
+
+    args = parser.parse_args()
+
+    s_time = time()
+    image = VirtualImage(args.legend, args.blockfldr, args.blockprfx, args.blocksffx, args.cache_bytes)
+    y0, y1, z0, z1, x0, x1 = args.roi
+    roi = image[y0:y1, z0:z1, x0:x1]
+    nib.save(nib.Nifti1Image(roi, np.eye(4)), args.output)
+    total_time = time() - s_time
+
+    if args.benchmark:
+        info = image.cache_info()
+        print('{0} of {1} blocks read, {2} bytes, in {3}s'.format(info['blocks_read'], len(image.position),
+                                                                 info['bytes_read'], total_time))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# Incremental build of the figures, run by generate_figures.sh from the root
+# of the repository.
+#
+# Every step of the figure pipeline is a target with input files, output
+# files and a command: the aggregation of the benchmark results, the model,
+# the export of each SVG figure, and each gnuplot script, whose data inputs
+# and outputs are read from the script itself. A target is rebuilt only if
+# the hash of its command and of the content of its inputs changed since its
+# last build, or if one of its outputs is missing. Hashes are kept in
+# figures/.build-hashes.json.
+#
+# A target depends on the targets producing its inputs. Targets are built
+# in waves of targets whose dependencies are built, the targets of a wave
+# in parallel.
+import argparse
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+from multiprocessing.pool import ThreadPool
+
+hash_file = 'figures/.build-hashes.json'
+
+
+class Target(object):
+
+    def __init__(self, name, command, inputs, outputs, log=None):
+        self.name = name
+        self.command = command
+        self.inputs = sorted(set(os.path.normpath(i) for i in inputs))
+        # outputs may be glob patterns
+        self.outputs = [os.path.normpath(o) for o in outputs]
+        # file receiving the standard output and error of the command
+        self.log = log
+
+    def hash(self):
+        h = hashlib.sha1(' '.join(self.command).encode())
+        for path in self.inputs:
+            h.update(path.encode())
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    h.update(hashlib.sha1(f.read()).digest())
+            else:
+                h.update(b'missing')
+        return h.hexdigest()
+
+    def produces(self, path):
+        return any(fnmatch.fnmatch(path, o) for o in self.outputs)
+
+    def is_stale(self, hashes):
+        return hashes.get(self.name) != self.hash() or not all(glob.glob(o) for o in self.outputs)
+
+    def build(self):
+        if self.log:
+            with open(self.log, 'w') as log:
+                return subprocess.call(self.command, stdout=log, stderr=subprocess.STDOUT)
+        return subprocess.call(self.command)
+
+
+def gnuplot_target(script, name=None, log=None):
+    """Return the target of a gnuplot script, with the data files it plots and the figures it outputs."""
+    with open(script) as f:
+        text = f.read()
+    inputs = re.findall(r"'(\./data/[^']+)'", text)
+    outputs = re.findall(r'set output "([^"]+)"', text)
+    if log:
+        outputs.append(log)
+    return Target(name or os.path.splitext(os.path.basename(script))[0], [script], [script] + inputs, outputs, log)
+
+
+def figure_targets():
+    targets = [
+        Target('aggregate', ['scripts/experiment/aggregate.py'],
+               ['scripts/experiment/aggregate.py'] +
+               [p for p in glob.glob('data/*/*.dat') if not p.endswith('_avg_var.dat')],
+               ['data/*/*_avg_var.dat', 'data/total-*-time-*.dat']),
+        # the model prints the number of seeks plotted by number_of_seeks.gnuplot
+        gnuplot_target('scripts/model/model.gnplt', 'model', log='data/seeks-model.dat')
+    ]
+
+    for svg in sorted(glob.glob('figures/svg/*.svg')):
+        name = os.path.splitext(os.path.basename(svg))[0]
+        targets.append(Target('svg/' + name, ['figures/svg/export_svg_files.sh', name],
+                              ['figures/svg/export_svg_files.sh', svg],
+                              ['figures/svg/{0}.pdf'.format(name), 'figures/svg/{0}.pdf_tex'.format(name)]))
+
+    for script in ['scripts/experiment/number_of_seeks.gnuplot',
+                   'scripts/experiment/split_and_merge_total_time.gnuplot',
+                   'scripts/experiment/compare_breakdown_errbar.gnuplot']:
+        targets.append(gnuplot_target(script))
+
+    return targets
+
+
+def dependencies(targets):
+    """Return the names of the targets producing the inputs of each target."""
+    return dict((t.name, set(o.name for o in targets if o is not t and any(o.produces(i) for i in t.inputs)))
+                for t in targets)
+
+
+def load_hashes():
+    if not os.path.exists(hash_file):
+        return {}
+    with open(hash_file) as f:
+        return json.load(f)
+
+
+def save_hashes(hashes):
+    with open(hash_file + '.tmp', 'w') as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
+    os.rename(hash_file + '.tmp', hash_file)
+
+
+def build(targets, names=None, jobs=None, force=False):
+    """Build the stale targets among names (default: all) and the targets they depend on.
+
+    Returns False if a command failed. The targets depending on a failed
+    target are not built.
+    """
+    deps = dependencies(targets)
+    by_name = dict((t.name, t) for t in targets)
+
+    wanted = set(names or by_name)
+    pending = list(wanted)
+    while pending:
+        for dep in deps[pending.pop()]:
+            if dep not in wanted:
+                wanted.add(dep)
+                pending.append(dep)
+
+    hashes = load_hashes()
+    remaining = [t for t in targets if t.name in wanted]
+    built, failed = set(), set()
+    pool = ThreadPool(jobs)
+    try:
+        while remaining:
+            wave = [t for t in remaining if deps[t.name] <= built | failed]
+            remaining = [t for t in remaining if t not in wave]
+
+            skipped = [t for t in wave if deps[t.name] & failed]
+            for t in skipped:
+                print('{0}: skipped, a dependency failed'.format(t.name))
+            wave = [t for t in wave if t not in skipped]
+            failed.update(t.name for t in skipped)
+
+            stale = [t for t in wave if force or t.is_stale(hashes)]
+            for t in wave:
+                print('{0}: {1}'.format(t.name, 'building' if t in stale else 'up to date'))
+
+            # inputs are hashed before building, as they are when checking staleness
+            target_hashes = [t.hash() for t in stale]
+            for t, h, status in zip(stale, target_hashes, pool.map(lambda t: t.build(), stale)):
+                if status == 0:
+                    hashes[t.name] = h
+                    built.add(t.name)
+                else:
+                    print('{0}: failed with status {1}'.format(t.name, status))
+                    hashes.pop(t.name, None)
+                    failed.add(t.name)
+            built.update(t.name for t in wave if t not in stale)
+            save_hashes(hashes)
+    finally:
+        pool.close()
+        pool.join()
+
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the stale figures')
+    parser.add_argument('targets', nargs='*', help="targets to build, with their dependencies (default: all)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="number of targets built in parallel (default: one per CPU)")
+    parser.add_argument('-f', '--force', action='store_true', help="rebuild targets even if they are up to date")
+    parser.add_argument('-l', '--list', action='store_true', help="list the targets and their dependencies")
+    args = parser.parse_args()
+
+    targets = figure_targets()
+
+    if args.list:
+        deps = dependencies(targets)
+        for t in targets:
+            print('{0}: {1}'.format(t.name, ' '.join(sorted(deps[t.name]))))
+        return
+
+    unknown = set(args.targets) - set(t.name for t in targets)
+    if unknown:
+        parser.error('unknown targets: {0}'.format(' '.join(sorted(unknown))))
+
+    if not build(targets, args.targets, args.jobs, args.force):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
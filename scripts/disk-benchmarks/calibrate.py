@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# Bounded calibration of a storage device, written to a device profile.
+#
+# disk-benchmark.py and seek.py run forever, and seek.py only times the lseek
+# system call, which does not move the disk head: nothing is read after the
+# seek. This calibration runs once, on a test file it creates in a folder of
+# the device, and measures:
+#   - the read and write throughput of sequential requests of each size,
+#     each size for at most a given volume and duration;
+#   - the latency of a seek followed by a small read, against the seek
+#     distance, from a few random positions per distance.
+# Files are opened with O_DIRECT where possible, so that the page cache does
+# not serve the reads. Elsewhere the file is dropped from the page cache
+# before every measurement (posix_fadvise, from Python 3.3).
+#
+# The device profile is a JSON file:
+#   {"direct": true, "alignment": 4096, "file_size": ...,
+#    "throughput": {"request_bytes": [...], "read": [...], "write": [...]},  (bytes/s)
+#    "seek": {"distance": [...], "latency": [...]}}                          (bytes, median s)
+# load_profile, throughput and seek_time read and interpolate it.
+import numpy as np
+from time import time
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bigbrain'))
+from direct_io import alignment, align_down, align_up, aligned_buffer, open_direct, drop_cache, read_at, write_at
+
+# example
+# ./calibrate.py /data/gao -o hdd.json
+# ./calibrate.py /home/gao -o ssd.json -s 2147483648 --max-seconds 5
+
+default_request_sizes = [4096 * 4**i for i in range(0, 8)]
+
+
+def write_test_file(path, size, chunk_bytes=64*1024**2):
+    """Write size bytes of random data to path, bypassing the page cache. Returns whether O_DIRECT was used."""
+    fd, direct = open_direct(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    f = io.FileIO(fd, 'w')
+    try:
+        buf = aligned_buffer(chunk_bytes)
+        # random data, in case the device compresses or deduplicates
+        buf[:] = np.random.RandomState(0).randint(0, 256, len(buf)).astype(np.uint8)
+        for offset in range(0, size, len(buf)):
+            write_at(f, buf[:min(len(buf), size - offset)], offset)
+        drop_cache(fd)
+    finally:
+        f.close()
+    return direct
+
+
+def open_test_file(path, mode):
+    fd, direct = open_direct(path, os.O_RDONLY if mode == 'r' else os.O_WRONLY)
+    return io.FileIO(fd, mode), direct
+
+
+def sequential_throughput(path, mode, request_bytes, volume, max_seconds):
+    """Return the throughput, in bytes/s, of sequential requests of request_bytes.
+
+    Requests are issued from the start of the file until volume bytes or
+    max_seconds, and at least one request. Writes are synced before the end.
+    """
+    f, direct = open_test_file(path, mode)
+    try:
+        buf = aligned_buffer(request_bytes)
+        if not direct:
+            drop_cache(f.fileno())
+        transferred = 0
+        s_time = time()
+        while transferred + request_bytes <= volume and (not transferred or time() - s_time < max_seconds):
+            if mode == 'r':
+                read_at(f, buf, transferred)
+            else:
+                write_at(f, buf, transferred)
+            transferred += request_bytes
+        if mode == 'w':
+            drop_cache(f.fileno())
+        return transferred / (time() - s_time)
+    finally:
+        f.close()
+
+
+def seek_latency(path, distance, samples, file_size, rng):
+    """Return the median time of a read of one aligned page distance bytes away from the previous read."""
+    f, direct = open_test_file(path, 'r')
+    try:
+        buf = aligned_buffer(alignment)
+        latencies = []
+        for i in range(0, samples):
+            first = align_down(rng.randint(0, file_size - distance - alignment))
+            second = first + distance
+            # seek forwards or backwards
+            if rng.random() < 0.5:
+                first, second = second, first
+            if not direct:
+                drop_cache(f.fileno())
+            read_at(f, buf, first)
+            s_time = time()
+            read_at(f, buf, second)
+            latencies.append(time() - s_time)
+        return float(np.median(latencies))
+    finally:
+        f.close()
+
+
+def calibrate(directory, file_size=1024**3, request_sizes=default_request_sizes, distances=16, samples=20,
+              volume=512*1024**2, max_seconds=10, keep=False, seed=0):
+    """Calibrate the device of directory, and return its profile."""
+    file_size = align_down(file_size)
+    request_sizes = sorted(set(align_up(s) for s in request_sizes if s <= file_size))
+    distances = sorted(set(align_down(int(round(d))) for d in
+                           np.geomspace(alignment, file_size - 2 * alignment, distances)))
+    rng = random.Random(seed)
+
+    fd, path = tempfile.mkstemp(dir=directory, prefix='calibrate-')
+    os.close(fd)
+    try:
+        print("writing a test file of {0} bytes".format(file_size))
+        direct = write_test_file(path, file_size)
+
+        throughput = {'request_bytes': request_sizes, 'read': [], 'write': []}
+        for request_bytes in request_sizes:
+            for mode, name in (('w', 'write'), ('r', 'read')):
+                throughput[name].append(sequential_throughput(path, mode, request_bytes, min(volume, file_size),
+                                                              max_seconds))
+            print("{0} bytes: read {1:.1f} MB/s, write {2:.1f} MB/s".format(
+                request_bytes, throughput['read'][-1] / 1024**2, throughput['write'][-1] / 1024**2))
+
+        seek = {'distance': distances, 'latency': []}
+        for distance in distances:
+            seek['latency'].append(seek_latency(path, distance, samples, file_size, rng))
+            print("{0} bytes away: {1:.6f}s".format(distance, seek['latency'][-1]))
+    finally:
+        if not keep:
+            os.remove(path)
+
+    return {'direct': direct, 'alignment': alignment, 'file_size': file_size, 'throughput': throughput,
+            'seek': seek}
+
+
+def load_profile(profile_fn):
+    with open(profile_fn) as f:
+        return json.load(f)
+
+
+def throughput(profile, request_bytes, direction='read'):
+    """Return the throughput, in bytes/s, of requests of request_bytes, interpolated on a log scale."""
+    measured = profile['throughput']
+    return np.interp(np.log2(np.maximum(request_bytes, 1)), np.log2(measured['request_bytes']), measured[direction])
+
+
+def seek_time(profile, distance):
+    """Return the latency of a seek of distance bytes (in either direction) and a small read, interpolated
+    on a log scale."""
+    measured = profile['seek']
+    return np.interp(np.log2(np.maximum(np.abs(distance), 1)), np.log2(measured['distance']), measured['latency'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the throughput and seek latency of a storage device')
+    parser.add_argument('directory', type=str, help="folder on the device, where the test file is written")
+    parser.add_argument('-o', '--output', type=str, required=True, help="device profile (JSON)")
+    parser.add_argument('-s', '--file-size', type=int, default=1024**3, help="test file size, in bytes")
+    parser.add_argument('-r', '--request-sizes', type=int, nargs='+', default=default_request_sizes,
+                        help="request sizes, in bytes")
+    parser.add_argument('--distances', type=int, default=16,
+                        help="number of seek distances, from a page to the test file size")
+    parser.add_argument('--samples', type=int, default=20, help="seeks per distance")
+    parser.add_argument('--volume', type=int, default=512*1024**2,
+                        help="maximum bytes transferred per request size and direction")
+    parser.add_argument('--max-seconds', type=float, default=10,
+                        help="maximum duration per request size and direction")
+    parser.add_argument('-k', '--keep', action='store_true', help="keep the test file")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the seek positions")
+    args = parser.parse_args()
+
+    s_time = time()
+    profile = calibrate(args.directory, args.file_size, args.request_sizes, args.distances, args.samples,
+                        args.volume, args.max_seconds, args.keep, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(profile, f, indent=1)
+    print("{0} written in {1}s".format(args.output, time() - s_time))
+
+if __name__ == '__main__':
+    main()
@@ -2,53 +2,60 @@
 
 import time
 import random
-import string
 import tempfile
 import os
+import io
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bigbrain'))
+from direct_io import drop_cache
+
+# Files are written from, and read into, the same 256 MB buffer of random
+# bytes, so that memory use does not depend on the file size.
+chunk_size = 256*1024*1024
+print("Creating random buffer of 256MB...")
+s = bytearray(os.urandom(chunk_size))
+chunk = memoryview(s)
 
-# A 256 MB random string
-print "Creating random string of 256MB..."
-s= ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(256*1024*1024))
-    
 while(True):
     # Picks a random file size between 256 MB and 6 GB.
     # size is expressed in multiples of 256MB
     size = random.randint(1,24)
-    
-    # Generates the string we will write to disk
-    buff = ''
-    n = 0
-    while ( n < size ):
-        buff += s
-        n += 1
+    length = size*chunk_size
 
     # Creates temp file
     fd, filename = tempfile.mkstemp(dir=os.getcwd())
-    # write file
-    f = open(filename,"w")
+    # write file, until the data is on the device and not only in the page cache
     write_start = time.time()
-    f.write(buff)
+    for n in range(0, size):
+        written = 0
+        while written < chunk_size:
+            written += os.write(fd, chunk[written:])
+    cached_end = time.time()
+    os.fsync(fd)
     write_end = time.time()
-    f.close()
-    # read file
-    f = open(filename,"r")
+    # read file from the device, not from the page cache
+    if not drop_cache(fd):
+        print("WARNING: the file cannot be dropped from the page cache, reads may be served from memory")
+    os.close(fd)
+    f = io.FileIO(filename, "r")
     read_start = time.time()
-    f.read(len(buff))
+    while f.readinto(chunk):
+        pass
     read_end = time.time()
     f.close()
     # open file and seek to the end
     f = open(filename,"w")
     seek_start = time.time()
-    f.seek(len(buff))
+    f.seek(length)
     seek_end = time.time()
     f.close()
-    
+
     os.remove(filename)
-    
-    # Print result
+
+    # Print result: size, write time, read time, seek time, write time without fsync
     f = open("benchmark.csv","a")
-    f.write(''+str(len(buff))+","+str(write_end-write_start)+","+str(read_end-read_start)+","+str(seek_end-seek_start)+"\n")
+    f.write(''+str(length)+","+str(write_end-write_start)+","+str(read_end-read_start)+","+str(seek_end-seek_start)+","+str(cached_end-write_start)+"\n")
     f.close()
     # Just in case...
     time.sleep(1)
-    
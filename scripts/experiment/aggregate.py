@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# Aggregation of the benchmark results into the data files plotted by the
+# gnuplot scripts (see generate_figures.sh).
+#
+# All the .dat files of the data folder are loaded once into a single table,
+# one row per (algorithm, direction, disk, compressed, mem, rep). The .dat
+# files hold one row per repetition, made of groups of 5 fields per memory
+# value:
+#   read time, write time, seek time, number of seeks, total time
+# The memory value of every group is taken from the numbered field
+# descriptions of the file header ("# 6. 3GB read time", "# 1. naive read
+# time"), so that adding a memory value only requires new data.
+#
+# Means, population standard deviations (as plotted so far) and 95%
+# confidence intervals of every group of repetitions are then computed at
+# once.
+import numpy as np
+import argparse
+import os
+import re
+
+# experiment of a .dat file name: (algorithm, direction)
+experiments = {
+    'mreads': ('multiple', 'merge'),
+    'mwrites': ('multiple', 'split'),
+    'creads': ('clustered', 'merge'),
+    'cwrites': ('clustered', 'split'),
+    'buff-slices_reads': ('buffered_slices', 'merge'),
+    'buff-slices_writes': ('buffered_slices', 'split')
+}
+
+# algorithm of the naive group ("naive" fields) of the files holding one
+naive_algorithms = {
+    'clustered': 'naive_blocks',
+    'buffered_slices': 'naive_slices'
+}
+
+dat_name = re.compile(r'^({0})_([^_]+)(_compressed)?\.dat$'.format('|'.join(experiments)))
+field_description = re.compile(r'^#\s*(\d+)\.\s*(naive|[\d.]+GB)\s')
+
+group_fields = ['read_time', 'write_time', 'seek_time', 'seek_number', 'total_time']
+
+table_dtype = [('algorithm', 'S16'), ('direction', 'S5'), ('disk', 'S8'), ('compressed', bool), ('mem', float),
+               ('rep', int)] + [(f, float) for f in group_fields]
+
+# two-sided 95% quantiles of Student's t distribution, by degrees of freedom
+t_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def group_mems(header_lines):
+    """Return the memory value, in GB, of each group of fields described in a .dat header (0 for naive)."""
+    mems = {}
+    for line in header_lines:
+        match = field_description.match(line)
+        if match:
+            mems[(int(match.group(1)) - 1) // len(group_fields)] = match.group(2)
+    return [0.0 if mems[g] == 'naive' else float(mems[g][:-2]) for g in sorted(mems)]
+
+
+def load_dat(dat_file, algorithm, direction, disk, compressed):
+    """Return the rows of the table held in a .dat file."""
+    with open(dat_file) as f:
+        lines = f.readlines()
+
+    mems = group_mems([line for line in lines if line.startswith('#')])
+    values = np.array([[float(e) for e in line.split()] for line in lines if '#' not in line and line.strip()])
+    if not len(values):
+        return np.zeros(0, dtype=table_dtype)
+    if values.shape[1] > len(mems) * len(group_fields):
+        raise ValueError('{0}: the header describes {1} fields, rows have {2}'.format(
+            dat_file, len(mems) * len(group_fields), values.shape[1]))
+    values = values.reshape(len(values), len(mems), len(group_fields))
+
+    reps, groups = len(values), len(mems)
+    rows = np.zeros(reps * groups, dtype=table_dtype)
+    # rows in repetition, then group order
+    mem = np.tile(mems, reps)
+    rows['algorithm'] = np.where(mem == 0, naive_algorithms.get(algorithm, algorithm), algorithm)
+    rows['direction'] = direction
+    rows['disk'] = disk
+    rows['compressed'] = compressed
+    rows['mem'] = mem
+    rows['rep'] = np.repeat(np.arange(reps), groups)
+    for i, field in enumerate(group_fields):
+        rows[field] = values[:, :, i].ravel()
+    return rows
+
+
+def load_table(data_dir):
+    """Load all the .dat files of the subfolders of data_dir into one table."""
+    tables = []
+    for folder in sorted(os.listdir(data_dir)):
+        if not os.path.isdir(os.path.join(data_dir, folder)):
+            continue
+        for name in sorted(os.listdir(os.path.join(data_dir, folder))):
+            match = dat_name.match(name)
+            if match:
+                algorithm, direction = experiments[match.group(1)]
+                tables.append(load_dat(os.path.join(data_dir, folder, name), algorithm, direction,
+                                       match.group(2), match.group(3) is not None))
+    return np.concatenate(tables)
+
+
+def aggregate(table):
+    """Return the mean, standard deviation and 95% confidence interval of every group of repetitions.
+
+    The result has one row per (algorithm, direction, disk, compressed, mem),
+    with n, the number of repetitions, and for each time field and for the
+    calculation time (the total time not spent reading, writing or seeking)
+    its mean, population standard deviation (<field>_std) and the half width
+    of its 95% confidence interval (<field>_ci).
+    """
+    keys = ['algorithm', 'direction', 'disk', 'compressed', 'mem']
+    groups, inverse = np.unique(table[keys], return_inverse=True)
+    n = np.bincount(inverse, minlength=len(groups)).astype(float)
+
+    columns = dict((f, table[f]) for f in group_fields)
+    columns['calculation_time'] = table['total_time'] - table['seek_time'] - table['write_time'] - table['read_time']
+
+    t = np.array([t_95[min(int(k), len(t_95)) - 1] if k > 1 else np.nan for k in n])
+
+    result_dtype = [(k, table.dtype[k]) for k in keys] + [('n', int)] + \
+                   [(f + suffix, float) for f in group_fields + ['calculation_time'] for suffix in ('', '_std', '_ci')]
+    result = np.zeros(len(groups), dtype=result_dtype)
+    for k in keys:
+        result[k] = groups[k]
+    result['n'] = n
+
+    for f, values in columns.items():
+        mean = np.bincount(inverse, values, minlength=len(groups)) / n
+        # two-pass variance, around the mean of each group
+        var = np.bincount(inverse, (values - mean[inverse])**2, minlength=len(groups)) / n
+        result[f] = mean
+        result[f + '_std'] = np.sqrt(var)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[f + '_ci'] = t * np.sqrt(var * n / (n - 1)) / np.sqrt(n)
+    return result
+
+
+def text(s):
+    # string fields of the table are bytes on Python 3
+    return s.decode() if isinstance(s, bytes) else s
+
+
+def select(stats, algorithm, direction, disk=None, compressed=False):
+    """Return the rows of stats of an algorithm (on any disk if disk is None), by increasing mem."""
+    selected = (stats['algorithm'] == algorithm.encode()) & (stats['direction'] == direction.encode()) & \
+               (stats['compressed'] == compressed)
+    if disk is not None:
+        selected &= stats['disk'] == disk.encode()
+    rows = stats[selected]
+    return rows[np.argsort(rows['mem'], kind='mergesort')]
+
+
+def value(rows, field, mem=None):
+    """Return the field of the row of a mem (the only row if None) as a float, or 0 if there is none."""
+    if mem is not None:
+        rows = rows[rows['mem'] == mem]
+    return float(rows[field][0]) if len(rows) else 0
+
+
+def mem_label(mem):
+    return '{0:g}'.format(mem)
+
+
+def breakdown_line(label, rows, mem=None):
+    return "{0} {1} {2} {3} {4} {5}".format(label, value(rows, 'calculation_time', mem), value(rows, 'read_time', mem),
+                                            value(rows, 'write_time', mem), value(rows, 'seek_time', mem),
+                                            value(rows, 'total_time_std', mem))
+
+
+def write_breakdown(stats, output_file, algorithm, direction, disk):
+    """Write the time breakdown of an algorithm at every mem, between the naive blocks and slices."""
+    rows = select(stats, algorithm, direction, disk)
+    with open(output_file, 'w') as f:
+        f.write("#time calculation_time read_time write_time seek_time total_time_error")
+        f.write('\n')
+        f.write(breakdown_line("naive-block", select(stats, 'naive_blocks', direction, disk)))
+        f.write('\n')
+        for mem in rows['mem']:
+            f.write(breakdown_line(mem_label(mem), rows, mem) + ' ')
+            f.write('\n')
+        f.write(breakdown_line("naive-slice", select(stats, 'naive_slices', direction, disk)))
+
+
+def write_total(stats, output_file, direction, disk, compressed=False):
+    """Write the total time of every algorithm and mem, with naive algorithms at 0.6 GB."""
+    names = {
+        'merge': ['Naive blocks', 'Naive slices', 'Cluster reads', 'Multiple reads', 'Buffered slices '],
+        'split': ['Naive blocks', 'Naive slices', 'Cluster writes', 'Multiple writes', 'Buffered slices ']
+    }[direction]
+    if compressed:
+        names = [name.strip() + ' (compressed)' for name in names]
+        # (sic) kept as plotted so far
+        if direction == 'merge':
+            names[4] += ' '
+    columns = ['NBR', 'NSR', 'CRR', 'MRR', 'BSR']
+
+    naive = [select(stats, a, direction, disk, compressed) for a in ('naive_blocks', 'naive_slices')]
+    others = [select(stats, a, direction, disk, compressed) for a in ('clustered', 'multiple', 'buffered_slices')]
+    mems = np.unique(np.concatenate([rows['mem'] for rows in others]))
+    mems = mems[mems > 0]
+
+    with open(output_file, 'w+') as f:
+        f.write("mem " + " ".join('"{0}" {1}'.format(name, column) for name, column in zip(names, columns)))
+        f.write('\n')
+        f.write("0.6 " + " ".join("{0} {1}".format(value(rows, 'total_time'), value(rows, 'total_time_std'))
+                                  for rows in naive) + " 0 0 0 0 0 0")
+        f.write('\n')
+        for mem in mems:
+            f.write("{0} 0 0 0 0 ".format(mem_label(mem)) +
+                    " ".join("{0} {1}".format(value(rows, 'total_time', mem), value(rows, 'total_time_std', mem))
+                             for rows in others))
+            f.write('\n')
+
+
+def write_summary(stats, output_file):
+    """Write all the statistics as a CSV file with a header."""
+    with open(output_file, 'w') as f:
+        f.write(','.join(stats.dtype.names))
+        f.write('\n')
+        for row in stats.tolist():
+            f.write(','.join(str(text(e)) for e in row))
+            f.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate the benchmark results into the plotted data files')
+    parser.add_argument('-d', '--data', type=str, default='./data', help="data folder")
+    parser.add_argument('-s', '--summary', type=str, default=None,
+                        help="also write the statistics of every group of repetitions to this CSV file")
+    args = parser.parse_args()
+
+    stats = aggregate(load_table(args.data))
+
+    # time breakdowns, per experiment and disk
+    for experiment, (algorithm, direction) in sorted(experiments.items()):
+        rows = select(stats, algorithm, direction)
+        for disk in sorted(set(text(disk) for disk in rows['disk'])):
+            write_breakdown(stats, os.path.join(args.data, experiment.split('_')[0],
+                                                '{0}_{1}_avg_var.dat'.format(experiment, disk)),
+                            algorithm, direction, disk)
+
+    # total times, per direction and disk, and for compressed merges
+    for direction, disk, compressed in sorted(set((text(d), text(k), bool(c)) for d, k, c in
+                                                  stats[['direction', 'disk', 'compressed']].tolist())):
+        if compressed and direction == 'split':
+            continue
+        write_total(stats, os.path.join(args.data, 'total-{0}-time-{1}{2}.dat'.format(
+            direction, disk, '-compressed' if compressed else '')), direction, disk, compressed)
+
+    if args.summary:
+        write_summary(stats, args.summary)
+
+if __name__ == '__main__':
+    main()
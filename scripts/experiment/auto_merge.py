@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# Ref: imageutils.py from
+# https://github.com/big-data-lab-team/sam/blob/master/imageutils.py
+#
+# Merge with the algorithm and memory predicted to be the fastest, instead
+# of an algorithm and mem chosen by the caller.
+#
+# The time of a merge is predicted as
+#   image bytes * (read + write + other cost per byte) + seeks * cost per seek
+# where the number of seeks of Naive blocks, Cluster reads and Multiple reads
+# comes from the seek model (scripts/model/model.py) at every candidate mem,
+# and the costs are measured:
+#   - on the device, by disk-benchmark.py (benchmark.csv: size, write time,
+#     read time, seek time) and seek.py (distance, seek time), or in a device
+#     profile written by calibrate.py;
+#   - or, per algorithm, from the merges recorded by benchmark.py on the same
+#     disk and with the same compression, which also accounts for the
+#     decompression and calculation times ("other").
+# The merge with the lowest predicted time is run, and the decision, the
+# predicted time and seeks, and the measured times are appended to a CSV
+# log, to see where the model is wrong.
+import numpy as np
+from time import time
+import argparse
+import csv
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model'))
+import model
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disk-benchmarks'))
+import calibrate
+import benchmark
+
+# example
+# ./auto_merge.py /home/gao/blocks125/legend.txt /home/gao/new_image.nii -m 17179869184 \
+#     --throughput benchmark.csv --seeks benchmark-seek-ssd.csv -l auto.csv
+# ./auto_merge.py /data/gao/blocks125/legend.txt /data/gao/new_image.nii -m 17179869184 --profile hdd.json -l auto.csv
+# ./auto_merge.py /home/gao/blocks125/legend.txt /home/gao/new_image.nii -m 17179869184 -z \
+#     --records results.csv --disk ssd -l auto.csv
+
+# merge algorithms the model predicts, as named by benchmark.py
+candidates = ['naive_blocks', 'clustered', 'multiple']
+
+log_fields = ['legend', 'disk', 'compression', 'algorithm', 'mem', 'predicted_time', 'predicted_seeks',
+              'total_read_time', 'total_write_time', 'total_seek_time', 'total_seek_number', 'total_time']
+
+
+def device_costs(throughput_csv, seek_csv=None):
+    """Return the costs measured by disk-benchmark.py and, if given, seek.py."""
+    throughput = np.loadtxt(throughput_csv, delimiter=',', ndmin=2)
+    costs = {
+        'read': throughput[:, 2].sum() / throughput[:, 0].sum(),
+        'write': throughput[:, 1].sum() / throughput[:, 0].sum(),
+        'seek': 0.0,
+        'other': 0.0
+    }
+    if seek_csv:
+        costs['seek'] = np.loadtxt(seek_csv, delimiter=',', ndmin=2)[:, 1].mean()
+    return costs
+
+
+def profile_costs(profile, request_bytes, seek_distance):
+    """Return the costs of requests of request_bytes and seeks of seek_distance bytes in a device profile."""
+    return {
+        'read': 1 / float(calibrate.throughput(profile, request_bytes, 'read')),
+        'write': 1 / float(calibrate.throughput(profile, request_bytes, 'write')),
+        'seek': float(calibrate.seek_time(profile, seek_distance)),
+        'other': 0.0
+    }
+
+
+def record_costs(results_csv, image_bytes, disk, compression, default=None):
+    """Return the costs of each algorithm, from the merges recorded by benchmark.py on disk with compression.
+
+    Algorithms without records get the default costs, if any.
+    """
+    sums = {}
+    with open(results_csv) as f:
+        for record in csv.DictReader(f):
+            if record['direction'] != 'merge' or record['disk'] != disk or record['compression'] != compression:
+                continue
+            times = [float(record[field]) for field in benchmark.time_fields]
+            s = sums.setdefault(record['algorithm'], np.zeros(len(times) + 1))
+            s += times + [1]
+
+    costs = {}
+    for algorithm in candidates:
+        if algorithm not in sums:
+            if default:
+                costs[algorithm] = default
+            continue
+        read, write, seek, seeks, total, runs = sums[algorithm]
+        costs[algorithm] = {
+            'read': read / (runs * image_bytes),
+            'write': write / (runs * image_bytes),
+            'seek': seek / seeks if seeks else (default['seek'] if default else 0.0),
+            'other': (total - read - write - seek) / (runs * image_bytes)
+        }
+    return costs
+
+
+def model_parameters(shape, dtype, legend):
+    """Return the cubic image dimension D, bytes per voxel b and blocks per dimension nu of the model."""
+    with open(legend) as f:
+        blocks = sum(1 for line in f if line.strip())
+    D = int(round(np.prod(shape, dtype=np.float64) ** (1 / 3.0)))
+    nu = int(round(blocks ** (1 / 3.0)))
+    return D, np.dtype(dtype).itemsize, nu
+
+
+def predicted_seeks(algorithm, mems, D, b, nu):
+    if algorithm == 'naive_blocks':
+        return np.full(len(mems), model.naive_blocks(D, b, nu), dtype=np.float64)
+    if algorithm == 'clustered':
+        return model.creads(mems, D, b, nu)
+    return model.mreads(mems, D, b, nu)
+
+
+def predict(mems, image_bytes, D, b, nu, costs):
+    """Return the predicted seeks and times of each candidate algorithm at every mem (NaN if undefined).
+
+    Every block is read at least once, so fewer seeks than blocks, which the
+    model predicts out of its range (even negative ones), are undefined.
+    """
+    seeks = np.array([predicted_seeks(a, mems, D, b, nu) for a in candidates])
+    with np.errstate(invalid='ignore'):
+        seeks[seeks < nu**3] = np.nan
+    times = np.array([image_bytes * (costs[a]['read'] + costs[a]['write'] + costs[a]['other']) +
+                      seeks[i] * costs[a]['seek'] if a in costs else np.full(len(mems), np.nan)
+                      for i, a in enumerate(candidates)])
+    return seeks, times
+
+
+def choose(mems, seeks, times):
+    """Return the algorithm, mem, predicted time and seeks of the fastest prediction, the smallest mem on ties."""
+    times = np.where(np.isnan(times), np.inf, times)
+    if np.isinf(times).all():
+        raise ValueError('no algorithm can be predicted with these mems and costs')
+    # mems are increasing, so that argmin picks the smallest mem of a tie
+    i, j = np.unravel_index(np.argmin(times), times.shape)
+    return candidates[i], run_mem(candidates[i], mems[j]), float(times[i, j]), float(seeks[i, j])
+
+
+def run_mem(algorithm, mem):
+    # naive blocks do not use mem, and are recorded by benchmark.py with mem = 0
+    return 0 if algorithm == 'naive_blocks' else int(mem)
+
+
+def candidate_mems(max_mem, steps, image_bytes):
+    # no merge uses more mem than the image
+    max_mem = min(max_mem, image_bytes)
+    return np.unique(np.linspace(max_mem / float(steps), max_mem, steps).astype(np.int64))
+
+
+def auto_merge(legend, reconstructed, shape, dtype, max_mem, costs, compression='none', disk='', steps=64,
+               log=None, run=True):
+    """Merge with the algorithm and mem (up to max_mem) of the lowest predicted time.
+
+    costs are the costs of every algorithm (see record_costs), or of the
+    device for all of them (see device_costs). Returns the log record of
+    the merge, without measured times if run is False.
+    """
+    if 'seek' in costs:
+        costs = dict((a, costs) for a in candidates)
+
+    D, b, nu = model_parameters(shape, dtype, legend)
+    image_bytes = np.prod(shape, dtype=np.float64) * np.dtype(dtype).itemsize
+    mems = candidate_mems(max_mem, steps, image_bytes)
+    seeks, times = predict(mems, image_bytes, D, b, nu, costs)
+    algorithm, mem, predicted_time, seek_number = choose(mems, seeks, times)
+
+    for i, a in enumerate(candidates):
+        finite = np.isfinite(times[i])
+        if finite.any():
+            j = np.flatnonzero(finite)[np.argmin(times[i][finite])]
+            print("{0}: {1:.1f}s predicted with mem = {2} ({3:g} seeks)".format(a, times[i, j], run_mem(a, mems[j]),
+                                                                                 seeks[i, j]))
+    print("running {0} with mem = {1}".format(algorithm, mem))
+
+    record = dict(legend=legend, disk=disk, compression=compression, algorithm=algorithm, mem=mem,
+                  predicted_time=predicted_time, predicted_seeks=seek_number)
+    if run:
+        if os.path.exists(reconstructed):
+            os.remove(reconstructed)
+        img = benchmark.img_utils.ImageUtils(reconstructed, shape[0], shape[1], shape[2], np.dtype(dtype))
+        method, method_mem = benchmark.imageutils_call(algorithm, mem)
+        s_time = time()
+        data = img.reconstruct_img(legend, method, method_mem, input_compressed=compression == 'gzip',
+                                   benchmark=True)
+        record.update(zip(log_fields[7:], tuple(data) + (time() - s_time,)))
+        print("{0}s predicted, {1}s measured".format(predicted_time, record['total_time']))
+
+    if log:
+        benchmark.append_record(log, record, log_fields)
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge with the algorithm and mem predicted to be the fastest')
+    parser.add_argument('legend', type=str, help="legend.txt of the blocks")
+    parser.add_argument('reconstructed', type=str, help="reconstructed image")
+    parser.add_argument('-s', '--shape', type=int, nargs=3, default=[3850, 3025, 3500], help="image shape")
+    parser.add_argument('-d', '--dtype', type=str, default='uint16', help="numpy datatype of the voxels")
+    parser.add_argument('-m', '--mem', type=int, required=True, help="memory budget, in bytes")
+    parser.add_argument('--steps', type=int, default=64, help="number of mems predicted, up to the budget")
+    parser.add_argument('-z', '--compressed', action='store_true', help="the blocks are gzipped")
+    parser.add_argument('--throughput', type=str, help="benchmark.csv written by disk-benchmark.py")
+    parser.add_argument('--seeks', type=str, help="seek times written by seek.py")
+    parser.add_argument('--profile', type=str, help="device profile written by calibrate.py")
+    parser.add_argument('--records', type=str, help="CSV records of benchmark.py")
+    parser.add_argument('--disk', type=str, default='', help="disk of the records to use")
+    parser.add_argument('-l', '--log', type=str, default=None, help="CSV file the decision is appended to")
+    parser.add_argument('-n', '--dry-run', action='store_true', help="only predict")
+    args = parser.parse_args()
+
+    if not args.throughput and not args.profile and not args.records:
+        parser.error('costs are needed: --throughput (and --seeks), --profile, or --records')
+
+    compression = 'gzip' if args.compressed else 'none'
+    default = None
+    if args.profile:
+        # seeks of the model jump between blocks, and reads and writes are of about a block
+        D, b, nu = model_parameters(args.shape, args.dtype, args.legend)
+        block_bytes = np.prod(args.shape, dtype=np.float64) * b / nu**3
+        default = profile_costs(calibrate.load_profile(args.profile), block_bytes, block_bytes)
+    elif args.throughput:
+        default = device_costs(args.throughput, args.seeks)
+    if args.records:
+        image_bytes = np.prod(args.shape, dtype=np.float64) * np.dtype(args.dtype).itemsize
+        costs = record_costs(args.records, image_bytes, args.disk, compression, default)
+    else:
+        costs = default
+
+    auto_merge(args.legend, args.reconstructed, args.shape, args.dtype, args.mem, costs, compression, args.disk,
+               args.steps, args.log, not args.dry_run)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# Ref: imageutils.py from
+# https://github.com/big-data-lab-team/sam/blob/master/imageutils.py
+#
+# Benchmark runner driven by a declarative matrix (see benchmark-matrix.json)
+# instead of one script per experiment. Every run is appended to a CSV file
+# as a self-describing record:
+#   algorithm, direction, disk, compression, mem, rep,
+#   total_read_time, total_write_time, total_seek_time, total_seek_number, total_time, peak_rss,
+#   max_buffer_bytes
+# and the memory of every run, per load (see ../bigbrain/mem_budget.py), to
+# {results}_mem/{algorithm}_{direction}_{disk}_{compression}_{mem}_{rep}.csv next to it.
+#
+# Matrix format:
+#   "image"  -- shape and dtype of the reconstructed image
+#   "splits" -- number of blocks along y, z and x; "slice_splits" likewise for slices
+#   "disks"  -- per storage tier, the paths used by the runs:
+#               image (split input), blocks and slices (block folders holding a legend.txt),
+#               reconstructed (merge output)
+#   "runs"   -- entries with algorithm, direction, mem (list), disks (list), compression
+#               (list of "none" or "gzip"), reps, and optionally dat, a legacy .dat file
+#               per disk, e.g. "./mwrites_{disk}.dat", appended with one row per repetition.
+#               As in imageutils, clustered algorithms with mem = 0 run (and are recorded
+#               as) the naive ones.
+#               The multiple_bb and multiple_bb_pipelined algorithms are the Multiple reads
+#               merges of ../bigbrain/merge_bb.py, without and with pipelined reads. Their
+#               compression is that of the reconstructed image: "none", "gzip" or "bgzf" on
+#               the fly (with "threads" threads, default 4), or "gzip_offline", a plain merge
+#               then gzip, whose time is part of the write time. With "direct": true, they
+#               read the blocks and write the image without leaving them in the page cache
+#               (see ../bigbrain/direct_io.py), and the page cache is not dropped before the
+#               run, which then needs no sudo. imageutils algorithms, and thus every split,
+#               still need drop_caches.
+#   "drop_caches" -- drop the page cache before every run (needs sudo), default true
+#   "strict_mem" -- if set, the overhead in bytes allowed over mem: runs that would use more than
+#               mem plus this overhead fail with a MemoryError (see ../bigbrain/mem_budget.py)
+#               instead of being killed. The peak RSS of every run is recorded either way.
+#   "rss_interval" -- seconds between the RSS samples of the imageutils runs, default 1: their
+#               loads are not accounted, so that their max_buffer_bytes is empty, and their
+#               memory log holds samples instead of loads
+import imageutils as img_utils
+import numpy as np
+from time import time
+import argparse
+import csv
+import json
+import random
+import os
+import shutil
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compression'))
+import gzip_index
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bigbrain'))
+from mem_budget import MemoryBudget, RssSampler
+import merge_bb
+
+# example
+# ./benchmark.py benchmark-matrix.json results.csv
+# ./benchmark.py benchmark-matrix.json results.csv -d nvme -a multiple clustered
+
+# merge_bb.py algorithms, merge only
+bb_algorithms = ['multiple_bb', 'multiple_bb_pipelined']
+algorithms = ['naive_slices', 'naive_blocks', 'buffered_slices', 'clustered', 'multiple'] + bb_algorithms
+directions = ['split', 'merge']
+compressions = ['none', 'gzip']
+bb_compressions = compressions + ['bgzf', 'gzip_offline']
+
+fields = ['algorithm', 'direction', 'disk', 'compression', 'mem', 'rep',
+          'total_read_time', 'total_write_time', 'total_seek_time', 'total_seek_number', 'total_time', 'peak_rss',
+          'max_buffer_bytes']
+time_fields = fields[6:11]
+
+
+def imageutils_call(algorithm, mem):
+    """Return the imageutils algorithm ('clustered' or 'multiple') and mem of a benchmark algorithm.
+
+    Naive variants are clustered with mem = 0, slices are blocks spanning
+    the full y and z dimensions.
+    """
+    if algorithm == 'multiple':
+        return 'multiple', mem
+    if algorithm.startswith('naive'):
+        return 'clustered', 0
+    return 'clustered', mem
+
+
+def record_algorithm(algorithm, mem):
+    """Return the algorithm a run is recorded as: with mem = 0, clustered algorithms are the naive ones."""
+    if mem == 0 and algorithm in ('clustered', 'buffered_slices'):
+        return 'naive_slices' if uses_slices(algorithm) else 'naive_blocks'
+    return algorithm
+
+
+def uses_slices(algorithm):
+    return algorithm.endswith('slices')
+
+
+def compressed_name(filename, compression):
+    if compression in ('gzip', 'bgzf', 'gzip_offline') and not filename.endswith('.gz'):
+        return filename + '.gz'
+    return filename
+
+
+def run_merge_bb(matrix, disk, algorithm, mem, compression, threads=4, direct=False, budget=None):
+    paths = matrix['disks'][disk]
+    reconstructed = compressed_name(paths['reconstructed'], compression)
+    if os.path.exists(reconstructed):
+        os.remove(reconstructed)
+
+    on_the_fly = compression if compression in ('gzip', 'bgzf') else None
+    output = reconstructed[:-len('.gz')] if compression == 'gzip_offline' else reconstructed
+    total_read_time, total_write_time, total_seek_time, total_seek_number = merge_bb.merge(
+        os.path.join(paths['blocks'], 'legend.txt'), output, mem, compression=on_the_fly, threads=threads,
+        pipelined=algorithm == 'multiple_bb_pipelined', direct=direct, budget=budget, benchmark=True)
+    if compression == 'gzip_offline':
+        t = time()
+        if os.system('gzip -f {0}'.format(output)):
+            raise RuntimeError('gzip of {0} failed'.format(output))
+        total_write_time += time() - t
+    return total_read_time, total_write_time, total_seek_time, total_seek_number
+
+
+def run_merge(matrix, disk, algorithm, mem, compression):
+    paths = matrix['disks'][disk]
+    block_folder = paths['slices'] if uses_slices(algorithm) else paths['blocks']
+    reconstructed = compressed_name(paths['reconstructed'], compression)
+    if os.path.exists(reconstructed):
+        os.remove(reconstructed)
+
+    shape = matrix['image']['shape']
+    img = img_utils.ImageUtils(reconstructed, shape[0], shape[1], shape[2], np.dtype(matrix['image']['dtype']))
+    method, mem = imageutils_call(algorithm, mem)
+    return img.reconstruct_img(os.path.join(block_folder, 'legend.txt'), method, mem,
+                               input_compressed=compression == 'gzip', benchmark=True)
+
+
+def run_split(matrix, disk, algorithm, mem, compression):
+    paths = matrix['disks'][disk]
+    out_dir = paths['slices'] if uses_slices(algorithm) else paths['blocks']
+    for f in os.listdir(out_dir):
+        path = os.path.join(out_dir, f)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    image = compressed_name(paths['image'], compression)
+    img = img_utils.ImageUtils(image)
+    if compression == 'gzip':
+        # split algorithms read through the image's array proxy, which then seeks with the index
+        img.proxy = gzip_index.load(image)
+
+    y_splits, z_splits, x_splits = matrix['slice_splits'] if uses_slices(algorithm) else matrix['splits']
+    method, mem = imageutils_call(algorithm, mem)
+    try:
+        if method == 'multiple':
+            return img.split_multiple_writes(y_splits, z_splits, x_splits, out_dir, mem, filename_prefix="bigbrain",
+                                             extension="nii", benchmark=True)
+        return img.split_clustered_writes(y_splits, z_splits, x_splits, out_dir, mem, filename_prefix="bigbrain",
+                                          extension="nii", benchmark=True)
+    finally:
+        if compression == 'gzip':
+            gzip_index.close(img.proxy)
+
+
+def run_once(matrix, disk, direction, algorithm, mem, compression, threads=4, direct=False):
+    """Return the times of a run, and its MemoryBudget.
+
+    direct runs do not leave their files in the page cache, which is
+    therefore not dropped before them.
+    """
+    if matrix.get('drop_caches', True) and not direct:
+        os.system("sync; echo 3 | sudo tee /proc/sys/vm/drop_caches")
+    budget = MemoryBudget(mem, matrix.get('strict_mem', 0), 'strict_mem' in matrix)
+    with budget:
+        s_time = time()
+        if algorithm in bb_algorithms:
+            data = run_merge_bb(matrix, disk, algorithm, mem, compression, threads, direct, budget)
+        else:
+            run = run_split if direction == 'split' else run_merge
+            with RssSampler(budget, matrix.get('rss_interval', 1.0)):
+                data = run(matrix, disk, algorithm, mem, compression)
+        total_read_time, total_write_time, total_seek_time, total_seek_number = data
+        total_time = time() - s_time
+    return (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time), budget
+
+
+def append_record(results_csv, record, record_fields=fields):
+    new = not os.path.exists(results_csv) or os.path.getsize(results_csv) == 0
+    with open(results_csv, 'a') as f:
+        writer = csv.DictWriter(f, fieldnames=record_fields)
+        if new:
+            writer.writeheader()
+        writer.writerow(record)
+
+
+def append_dat_row(data_dict, dat_file):
+    # legacy row: (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time) per mem, by mem
+    with open(dat_file, "a") as f:
+        for k in sorted(data_dict.keys()):
+            for e in data_dict[k]:
+                f.write(str(e) + " ")
+        f.write("\n")
+
+
+def mem_log_name(results_csv, algorithm, direction, disk, compression, mem, rep):
+    folder = os.path.splitext(results_csv)[0] + '_mem'
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    return os.path.join(folder, '{0}_{1}_{2}_{3}_{4}_{5}.csv'.format(algorithm, direction, disk, compression, mem,
+                                                                     rep))
+
+
+def validate(matrix):
+    for run in matrix['runs']:
+        if run['algorithm'] not in algorithms:
+            raise ValueError('unknown algorithm {0}, expected one of {1}'.format(run['algorithm'], algorithms))
+        if run['direction'] not in directions:
+            raise ValueError('unknown direction {0}, expected one of {1}'.format(run['direction'], directions))
+        for disk in run['disks']:
+            if disk not in matrix['disks']:
+                raise ValueError('disk {0} is not described in the matrix'.format(disk))
+        if run['algorithm'] in bb_algorithms and run['direction'] != 'merge':
+            raise ValueError('{0} only merges'.format(run['algorithm']))
+        if run.get('direct') and run['algorithm'] not in bb_algorithms:
+            raise ValueError('direct runs need a merge_bb algorithm, {0} is not one'.format(run['algorithm']))
+        valid = bb_compressions if run['algorithm'] in bb_algorithms else compressions
+        for compression in run.get('compression', ['none']):
+            if compression not in valid:
+                raise ValueError('unknown compression {0} for {1}, expected one of {2}'.format(
+                    compression, run['algorithm'], valid))
+
+
+def run_matrix(matrix, results_csv, only_disks=None, only_algorithms=None):
+    """Run every entry of the matrix, optionally restricted to some disks and algorithms.
+
+    Memory values are shuffled in each repetition, and every run is recorded
+    as soon as it ends.
+    """
+    validate(matrix)
+    for run in matrix['runs']:
+        if only_algorithms and run['algorithm'] not in only_algorithms:
+            continue
+        for disk in run['disks']:
+            if only_disks and disk not in only_disks:
+                continue
+            for compression in run.get('compression', ['none']):
+                # naive algorithms do not depend on mem
+                mem_list = [0] if run['algorithm'].startswith('naive') else list(run['mem'])
+                for rep in range(0, run['reps']):
+                    print("{0} {1}, {2}, compression {3} - repetition {4}".format(
+                        run['algorithm'], run['direction'], disk, compression, rep))
+                    random.shuffle(mem_list)
+                    data_dict = {}
+                    for mem in mem_list:
+                        print("mem = {0}".format(mem))
+                        data, budget = run_once(matrix, disk, run['direction'], run['algorithm'], mem,
+                                                  compression, run.get('threads', 4), run.get('direct', False))
+                        data_dict[mem] = data
+                        record = dict(zip(time_fields, data))
+                        record.update(algorithm=record_algorithm(run['algorithm'], mem), direction=run['direction'], disk=disk,
+                                      compression=compression, mem=mem, rep=rep, peak_rss=budget.peak_rss,
+                                      max_buffer_bytes=budget.max_buffer_bytes())
+                        append_record(results_csv, record)
+                        budget.write_log(mem_log_name(results_csv, record['algorithm'], run['direction'], disk,
+                                                      compression, mem, rep))
+                    if 'dat' in run:
+                        append_dat_row(data_dict, run['dat'].format(disk=disk, compression=compression))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the split and merge benchmarks described by a matrix')
+    parser.add_argument('matrix', type=str, help="JSON benchmark matrix")
+    parser.add_argument('results', type=str, help="CSV file the records are appended to")
+    parser.add_argument('-d', '--disks', nargs='+', help="only run on these disks of the matrix")
+    parser.add_argument('-a', '--algorithms', nargs='+', choices=algorithms, help="only run these algorithms")
+    args = parser.parse_args()
+
+    with open(args.matrix) as f:
+        matrix = json.load(f)
+
+    run_matrix(matrix, args.results, args.disks, args.algorithms)
+
+if __name__ == '__main__':
+    main()
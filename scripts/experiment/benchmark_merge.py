@@ -1,16 +1,26 @@
 #!/usr/bin/env python
 # Ref: imageutils.py from
 # https://github.com/big-data-lab-team/sam/blob/master/imageutils.py
+#
+# Legacy: superseded by benchmark.py and benchmark-matrix.json, where the
+# pipelined merge is the multiple_bb_pipelined algorithm. Only kept to append
+# to the existing {disk}.dat, {disk}_bb.dat and {disk}_pipelined.dat files.
 import imageutils as img_utils
 import numpy as np
 from time import time
 import argparse
 import random
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bigbrain'))
+import merge_bb
 
 # example
 # ./benchmark_merge.py -m 3221225472 9663676416 -r 5 -d ssd
 # ./benchmark_merge.py -m 3221225472 9663676416 -r 5 -d hdd
+# ./benchmark_merge.py -m 3221225472 9663676416 -r 5 -d ssd -b
+# ./benchmark_merge.py -m 3221225472 9663676416 -r 5 -d ssd -p
 
 
 # on the consider
@@ -24,6 +34,13 @@ legend_ssd = "/home/gao/blocks125/legend.txt"
 csv_file_hdd = "./hdd.dat"
 csv_file_ssd = "./ssd.dat"
 
+# Multiple reads of merge_bb.py, sequential (the baseline of the pipelined ones) and
+# pipelined, with the overlap as a sixth field per mem
+csv_file_hdd_bb = "./hdd_bb.dat"
+csv_file_ssd_bb = "./ssd_bb.dat"
+csv_file_hdd_pipelined = "./hdd_pipelined.dat"
+csv_file_ssd_pipelined = "./ssd_pipelined.dat"
+
 
 first_dim=3850
 second_dim=3025
@@ -34,6 +51,16 @@ files = {
     "ssd": (reconstructed_ssd, legend_ssd, csv_file_ssd)
 }
 
+bb_files = {
+    "hdd": (reconstructed_hdd, legend_hdd, csv_file_hdd_bb),
+    "ssd": (reconstructed_ssd, legend_ssd, csv_file_ssd_bb)
+}
+
+pipelined_files = {
+    "hdd": (reconstructed_hdd, legend_hdd, csv_file_hdd_pipelined),
+    "ssd": (reconstructed_ssd, legend_ssd, csv_file_ssd_pipelined)
+}
+
 def benchmark_mreads(mem, reconstructed, legend):
     img = img_utils.ImageUtils(reconstructed, first_dim, second_dim, third_dim, np.uint16)
     s_time = time()
@@ -41,8 +68,17 @@ def benchmark_mreads(mem, reconstructed, legend):
     total_time = time() - s_time
     return (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time)
 
+def benchmark_pipelined_mreads(mem, reconstructed, legend, pipelined=True):
+    s_time = time()
+    total_read_time, total_write_time, total_seek_time, total_seek_number = merge_bb.merge(legend, reconstructed, mem, pipelined=pipelined, benchmark=True)
+    total_time = time() - s_time
+    # reads run in a separate thread, so the time spent reading and writing at once is
+    # what the sum of the read and write times exceeds the elapsed time by (about 0 if not pipelined)
+    overlap_time = max(0, total_read_time + total_write_time + total_seek_time - total_time)
+    return (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time, overlap_time)
+
 def write_to_file(data_dict, dat_file):
-    # (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time)
+    # (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time[, overlap_time])
     with open(dat_file, "a") as f:
         for k in sorted(data_dict.keys()):
             for e in data_dict[k]:
@@ -55,11 +91,18 @@ def main():
     parser.add_argument('-m', '--mem', nargs='+', type=int, help="mem in bytes. A list of mems is required", required=True)
     parser.add_argument('-r', '--rep', type=int, help="how many repetitions on each mem", required=True)
     parser.add_argument('-d', '--disk', choices=['ssd', 'hdd'], help="running on hdd or ssd", required=True)
+    variant = parser.add_mutually_exclusive_group()
+    variant.add_argument('-b', '--baseline', action='store_true',
+                         help="run the sequential Multiple reads of merge_bb.py, the baseline of --pipelined")
+    variant.add_argument('-p', '--pipelined', action='store_true',
+                         help="run the pipelined Multiple reads of merge_bb.py, mem being split between two loads. "
+                              "Only Multiple reads are pipelined, there is no pipelined Clustered reads")
     args = parser.parse_args()
 
     mem_list = args.mem
     rep = args.rep
     disk = args.disk
+    run_files = pipelined_files if args.pipelined else bb_files if args.baseline else files
 
     for i in range(0, rep):
         data_dict = {}
@@ -68,10 +111,14 @@ def main():
         for mem in mem_list:
             print "mem = {}".format(mem)
             os.system("echo 3 | sudo tee /proc/sys/vm/drop_caches")
-            os.system("rm {}".format(files[disk][0]))
-            data = benchmark_mreads(mem=mem, reconstructed=files[disk][0], legend=files[disk][1])
+            os.system("rm {}".format(run_files[disk][0]))
+            if args.pipelined or args.baseline:
+                data = benchmark_pipelined_mreads(mem=mem, reconstructed=run_files[disk][0], legend=run_files[disk][1],
+                                                  pipelined=args.pipelined)
+            else:
+                data = benchmark_mreads(mem=mem, reconstructed=run_files[disk][0], legend=run_files[disk][1])
             data_dict[mem] = data
-        write_to_file(data_dict, files[disk][2])
+        write_to_file(data_dict, run_files[disk][2])
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 # Ref: imageutils.py from
 # https://github.com/big-data-lab-team/sam/blob/master/imageutils.py
+#
+# Legacy: superseded by ../benchmark.py and ../benchmark-matrix.json (gzip
+# compression). Only kept to append to the existing *_compressed.dat files.
 import imageutils as img_utils
+import gzip_index
 import numpy as np
 from time import time
 import argparse
@@ -27,15 +31,38 @@ csv_file_ssd_mreads = "./mreads_ssd_compressed.dat"
 csv_file_ssd_creads = "./creads_ssd_compressed.dat"
 
 
+# split of the compressed image, seeking through its seek-point index, into
+# its own folders: those of the legends above hold the blocks merged
+ori_image_hdd = "/data/bigbrain_40microns.nii.gz"
+out_dir_hdd = "/data/gao/blocks_split_indexed"
+
+ori_image_ssd = "/data/bigbrain_40microns.nii.gz"
+out_dir_ssd = "/home/gao/blocks125_split_indexed"
+
+csv_file_hdd_nblocks = "./nblocks_hdd_compressed_indexed.dat"
+csv_file_hdd_cwrites = "./cwrites_hdd_compressed_indexed.dat"
+csv_file_ssd_nblocks = "./nblocks_ssd_compressed_indexed.dat"
+csv_file_ssd_cwrites = "./cwrites_ssd_compressed_indexed.dat"
+
+
 first_dim=3850
 second_dim=3025
 third_dim=3500
 
+Y_splits=5
+Z_splits=5
+X_splits=5
+
 files = {
     "hdd": (reconstructed_hdd, legend_hdd, csv_file_hdd_mreads, csv_file_hdd_creads),
     "ssd": (reconstructed_ssd, legend_ssd, csv_file_ssd_mreads, csv_file_ssd_creads)
 }
 
+split_files = {
+    "hdd": (ori_image_hdd, out_dir_hdd, csv_file_hdd_nblocks, csv_file_hdd_cwrites),
+    "ssd": (ori_image_ssd, out_dir_ssd, csv_file_ssd_nblocks, csv_file_ssd_cwrites)
+}
+
 def benchmark_mreads(mem, reconstructed, legend):
     img = img_utils.ImageUtils(reconstructed, first_dim, second_dim, third_dim, np.uint16)
     s_time = time()
@@ -53,6 +80,21 @@ def benchmark_creads(mem, reconstructed, legend):
     print total_read_time, total_write_time, total_seek_time, total_seek_number, total_time
     return (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time)
 
+def benchmark_cwrites_indexed(mem, ori_image, out_dir):
+    # mem = 0 is Naive blocks
+    img = img_utils.ImageUtils(ori_image)
+    # split algorithms read through the image's array proxy, which now seeks with the index
+    img.proxy = gzip_index.load(ori_image)
+    try:
+        s_time = time()
+        total_read_time, total_write_time, total_seek_time, total_seek_number = img.split_clustered_writes(Y_splits, Z_splits, X_splits, out_dir, mem, filename_prefix="bigbrain",
+                              extension="nii", benchmark=True)
+        total_time = time() - s_time
+    finally:
+        gzip_index.close(img.proxy)
+    print total_read_time, total_write_time, total_seek_time, total_seek_number, total_time
+    return (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time)
+
 def write_to_file(data_dict, dat_file):
     # (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time)
     print "saved to ", dat_file
@@ -102,5 +144,32 @@ def main():
             data_dict[mem] = data
         write_to_file(data_dict, files[disk][3])
 
+
+
+    ## NAIVE BLOCKS AND CWRITES, INDEXED:
+    # the index is built once, its build time is not part of the runs
+    print "index built in {}s".format(gzip_index.build_index(split_files[disk][0]))
+    if not os.path.isdir(split_files[disk][1]):
+        os.makedirs(split_files[disk][1])
+
+    for i in range(0, rep):
+        print "Repetition: {}".format(i)
+        os.system("echo 3 | sudo tee /proc/sys/vm/drop_caches")
+        os.system("rm -rf {}/*".format(split_files[disk][1]))
+        data = benchmark_cwrites_indexed(mem=0, ori_image=split_files[disk][0], out_dir=split_files[disk][1])
+        write_to_file({0: data}, split_files[disk][2])
+
+    for i in range(0, rep):
+        data_dict = {}
+        print "Repetition: {}".format(i)
+        random.shuffle(mem_list)
+        for mem in mem_list:
+            print "mem = {}".format(mem)
+            os.system("echo 3 | sudo tee /proc/sys/vm/drop_caches")
+            os.system("rm -rf {}/*".format(split_files[disk][1]))
+            data = benchmark_cwrites_indexed(mem=mem, ori_image=split_files[disk][0], out_dir=split_files[disk][1])
+            data_dict[mem] = data
+        write_to_file(data_dict, split_files[disk][3])
+
 if __name__ == '__main__':
     main()
@@ -1,15 +1,25 @@
 #!/usr/bin/env python
 # Ref: imageutils.py from
 # https://github.com/big-data-lab-team/sam/blob/master/imageutils.py
+#
+# Legacy: superseded by ../benchmark.py and ../benchmark-matrix.json, where
+# the merge_bb variants are the multiple_bb algorithm with the gzip_offline,
+# gzip and bgzf compressions. Only kept to append to the existing
+# blocks_{disk}_compressed*.dat files.
 import imageutils as img_utils
 import numpy as np
 from time import time
 import argparse
 import random
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'bigbrain'))
+import merge_bb
 
 # example
 # ./compressed_blocks.py -m 0  -r 2 -d ssd
+# ./compressed_blocks.py -m 3221225472 -r 2 -d ssd -v offline_bb gzip bgzf -t 8
 
 
 
@@ -20,11 +30,20 @@ legend_hdd = "/data/gao/blocks125/legend.txt"
 reconstructed_ssd = "/home/gao/new_image.nii"
 legend_ssd = "/home/gao/blocks125/legend.txt"
 
+reconstructed_hdd_compressed = "/data/gao/new_image.nii.gz"
 reconstructed_ssd_compressed = "/home/gao/new_image.nii.gz"
 
 csv_file_ssd_slices = "./blocks_ssd_compressed.dat"
 csv_file_hdd_slices = "./blocks_hdd_compressed.dat"
 
+# Multiple reads merges (merge_bb.py), compressed offline or on the fly
+csv_file_ssd_offline_bb = "./blocks_ssd_compressed_offline_bb.dat"
+csv_file_hdd_offline_bb = "./blocks_hdd_compressed_offline_bb.dat"
+csv_file_ssd_gzip = "./blocks_ssd_compressed_gzip.dat"
+csv_file_hdd_gzip = "./blocks_hdd_compressed_gzip.dat"
+csv_file_ssd_bgzf = "./blocks_ssd_compressed_bgzf.dat"
+csv_file_hdd_bgzf = "./blocks_hdd_compressed_bgzf.dat"
+
 first_dim=3850
 second_dim=3025
 third_dim=3500
@@ -34,7 +53,15 @@ files = {
     "ssd": (reconstructed_ssd, legend_ssd, csv_file_ssd_slices)
 }
 
+compressed_files = {
+    "hdd": (reconstructed_hdd_compressed, {"offline_bb": csv_file_hdd_offline_bb, "gzip": csv_file_hdd_gzip,
+                                           "bgzf": csv_file_hdd_bgzf}),
+    "ssd": (reconstructed_ssd_compressed, {"offline_bb": csv_file_ssd_offline_bb, "gzip": csv_file_ssd_gzip,
+                                           "bgzf": csv_file_ssd_bgzf})
+}
+
 
+# legacy reference: clustered reads of imageutils, then gzip
 def benchmark_creads(mem, reconstructed, legend):
     img = img_utils.ImageUtils(reconstructed, first_dim, second_dim, third_dim, np.uint16)
     s_time = time()
@@ -50,6 +77,24 @@ def benchmark_creads(mem, reconstructed, legend):
     print total_read_time, total_write_time, total_seek_time, total_seek_number, compressing_time, total_time
     return (total_read_time, total_write_time, total_seek_time, total_seek_number, compressing_time, total_time)
 
+def benchmark_merge_bb(mem, reconstructed, legend, compression, threads):
+    s_time = time()
+    if compression == 'offline_bb':
+        # reconstructed is the .nii.gz, gzip writes it from the plain image
+        plain = reconstructed[:-len('.gz')]
+        total_read_time, total_write_time, total_seek_time, total_seek_number = merge_bb.merge(legend, plain, mem, compression=None, benchmark=True)
+        e_time = time()
+        print "offline compressing..."
+        os.system("gzip {}".format(plain))
+        compressing_time = time() - e_time
+    else:
+        total_read_time, total_write_time, total_seek_time, total_seek_number = merge_bb.merge(legend, reconstructed, mem, compression=compression, threads=threads, benchmark=True)
+        # compression is done on the fly and is part of the write time
+        compressing_time = 0
+    total_time = time() - s_time
+    print total_read_time, total_write_time, total_seek_time, total_seek_number, compressing_time, total_time
+    return (total_read_time, total_write_time, total_seek_time, total_seek_number, compressing_time, total_time)
+
 def write_to_file(data_dict, dat_file):
     # (total_read_time, total_write_time, total_seek_time, total_seek_number, total_time)
     print "saved to ", dat_file
@@ -65,30 +110,54 @@ def main():
     parser.add_argument('-m', '--mem', nargs='+', type=int, help="mem in bytes. A list of mems is required", required=True)
     parser.add_argument('-r', '--rep', type=int, help="how many repetitions on each mem", required=True)
     parser.add_argument('-d', '--disk', choices=['ssd', 'hdd'], help="running on hdd or ssd", required=True)
+    parser.add_argument('-v', '--variants', nargs='+', choices=['offline', 'offline_bb', 'gzip', 'bgzf'],
+                        default=['offline_bb', 'gzip', 'bgzf'],
+                        help="offline_bb: multiple reads then gzip; gzip, bgzf: multiple reads compressed on the fly, "
+                             "single-threaded or with parallel gzip members; offline (legacy reference): clustered "
+                             "reads of imageutils then gzip")
+    parser.add_argument('-t', '--threads', type=int, default=4, help="compression threads for bgzf")
     args = parser.parse_args()
 
     mem_list = args.mem
     rep = args.rep
     disk = args.disk
-
-
-    ## buffer slices (mem = 3,6,9,12,16) + naive slices (mem = 0)
-    for i in range(0, rep):
-        data_dict = {}
-        print "%%%%%%%%%%%%%%%%%%%%%%% Repetition: {} %%%%%%%%%%%%%%%%%%%%%%%".format(i)
-        random.shuffle(mem_list)
-        for mem in mem_list:
-            print "---------------------- mem = {} ----------------------".format(mem)
-            os.system("echo 3 | sudo tee /proc/sys/vm/drop_caches")
-            os.system("rm {}".format(files[disk][0]))
-            os.system("rm {}".format(reconstructed_ssd_compressed))
-
-            data = benchmark_creads(mem=mem, reconstructed=files[disk][0], legend=files[disk][1])
-            data_dict[mem] = data
-
-
-
-        write_to_file(data_dict, files[disk][2])
+    variants = args.variants
+
+
+    ## legacy reference: buffer slices (mem = 3,6,9,12,16) + naive slices (mem = 0)
+    if 'offline' in variants:
+        for i in range(0, rep):
+            data_dict = {}
+            print "%%%%%%%%%%%%%%%%%%%%%%% Repetition: {} %%%%%%%%%%%%%%%%%%%%%%%".format(i)
+            random.shuffle(mem_list)
+            for mem in mem_list:
+                print "---------------------- mem = {} ----------------------".format(mem)
+                os.system("echo 3 | sudo tee /proc/sys/vm/drop_caches")
+                os.system("rm {}".format(files[disk][0]))
+                os.system("rm {}".format(compressed_files[disk][0]))
+
+                data = benchmark_creads(mem=mem, reconstructed=files[disk][0], legend=files[disk][1])
+                data_dict[mem] = data
+
+
+
+            write_to_file(data_dict, files[disk][2])
+
+
+    ## multiple reads compressed offline, or on the fly with gzip and with parallel gzip members
+    for compression in [v for v in variants if v != 'offline']:
+        for i in range(0, rep):
+            data_dict = {}
+            print "%%%%%%%%%%%%%%%%%%%%%%% {} - Repetition: {} %%%%%%%%%%%%%%%%%%%%%%%".format(compression, i)
+            random.shuffle(mem_list)
+            for mem in mem_list:
+                print "---------------------- mem = {} ----------------------".format(mem)
+                os.system("echo 3 | sudo tee /proc/sys/vm/drop_caches")
+                os.system("rm {}".format(compressed_files[disk][0]))
+                data = benchmark_merge_bb(mem=mem, reconstructed=compressed_files[disk][0], legend=files[disk][1],
+                                          compression=compression, threads=args.threads)
+                data_dict[mem] = data
+            write_to_file(data_dict, compressed_files[disk][1][compression])
 
 if __name__ == '__main__':
     main()
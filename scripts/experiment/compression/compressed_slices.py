@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 # Ref: imageutils.py from
 # https://github.com/big-data-lab-team/sam/blob/master/imageutils.py
+#
+# Legacy: superseded by ../benchmark.py and ../benchmark-matrix.json
+# (buffered_slices with gzip compression). Only kept to append to the
+# existing slices_{disk}_compressed.dat files.
 import imageutils as img_utils
 import numpy as np
 from time import time
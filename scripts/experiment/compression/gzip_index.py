@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# Seek-point index for gzipped NIfTI images, built with indexed_gzip
+# (https://github.com/pauldmccarthy/indexed_gzip) and stored in a sidecar
+# file next to the image. Seeking in a plain gzip stream decompresses all
+# the data up to the seek position; with the index, a seek only
+# decompresses from the nearest seek point.
+import nibabel as nib
+import argparse
+import os
+from time import time
+
+try:
+    import indexed_gzip as igzip
+except ImportError:
+    igzip = None
+
+# distance between seek points in the uncompressed data, in bytes
+default_spacing = 4 * 1024**2
+
+
+def index_filename(filename):
+    return filename + '.gzidx'
+
+
+def check_indexed_gzip():
+    if igzip is None:
+        raise ImportError('indexed_gzip is required for seeking in compressed images: pip install indexed_gzip')
+
+
+def build_index(filename, spacing=default_spacing):
+    """Build the seek-point index of a gzip file and save it in its sidecar file.
+
+    Returns the time taken to build the index.
+    """
+    check_indexed_gzip()
+    s_time = time()
+    fobj = igzip.IndexedGzipFile(filename, spacing=spacing)
+    try:
+        fobj.build_full_index()
+        fobj.export_index(index_filename(filename))
+    finally:
+        fobj.close()
+    return time() - s_time
+
+
+def open_indexed(filename, spacing=default_spacing):
+    """Open a gzip file for reading, with its seek-point index.
+
+    The sidecar index is built first if it is missing or older than the file.
+    """
+    check_indexed_gzip()
+    index_fn = index_filename(filename)
+    if not os.path.exists(index_fn) or os.path.getmtime(index_fn) < os.path.getmtime(filename):
+        build_index(filename, spacing)
+    return igzip.IndexedGzipFile(filename, spacing=spacing, index_file=index_fn)
+
+
+def load(filename, spacing=default_spacing):
+    """Load a gzipped NIfTI image whose array proxy reads through the seek-point index."""
+    fobj = open_indexed(filename, spacing)
+    holder = nib.FileHolder(filename=filename, fileobj=fobj)
+    return nib.Nifti1Image.from_file_map({'header': holder, 'image': holder})
+
+
+def close(image):
+    """Close the indexed gzip file of an image returned by load."""
+    image.file_map['image'].fileobj.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the seek-point index of gzipped images')
+    parser.add_argument('images', nargs='+', help="gzipped images to index")
+    parser.add_argument('-s', '--spacing', type=int, default=default_spacing,
+                        help="distance between seek points in the uncompressed data, in bytes")
+    args = parser.parse_args()
+
+    for image in args.images:
+        print('{0}: index built in {1}s'.format(index_filename(image), build_index(image, args.spacing)))
+
+if __name__ == '__main__':
+    main()
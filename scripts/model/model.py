@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# NumPy version of the seek model of model.gnplt, for Cluster reads (cases 1
+# to 3), Multiple reads (cases 1 to 5), and the naive and buffered slices.
+#
+# The model is evaluated on whole grids at once: the memory x (bytes), the
+# image dimension D (voxels, the image is D^3), the bytes per voxel b and
+# the number of blocks per dimension nu (n = nu^3 blocks) are broadcast
+# against each other.
+#
+# The equations are written as in model.gnplt, with gnuplot's arithmetic:
+# the division of two integers truncates, floor and ceil return integers,
+# and the result of a division or modulo by zero is undefined (NaN here).
+# Integer memory values therefore give the values printed by model.gnplt,
+# and float memory values those it plots. D, b and nu must be integers.
+import numpy as np
+import argparse
+
+# memory values, in bytes, of the values printed by model.gnplt
+printed_mems = [3*1024**3, 6*1024**3, 9*1024**3, 12*1024**3, 16*1024**3]
+
+
+class Gnuplot(object):
+    """gnuplot operators on numpy arrays, recording where the result is undefined."""
+
+    def __init__(self):
+        self.undefined = False
+
+    def div(self, a, b):
+        a, b = np.asarray(a), np.asarray(b)
+        zero = b == 0
+        self.undefined = self.undefined | zero
+        b = np.where(zero, 1, b)
+        if a.dtype.kind in 'iu' and b.dtype.kind in 'iu':
+            # C division, truncating towards zero
+            q = np.abs(a) // np.abs(b)
+            return np.where((a < 0) != (b < 0), -q, q)
+        return a / b
+
+    def mod(self, a, b):
+        b = np.asarray(b)
+        zero = b == 0
+        self.undefined = self.undefined | zero
+        # C remainder, of the sign of a
+        return np.fmod(a, np.where(zero, 1, b))
+
+    def floor(self, a):
+        a = np.asarray(a)
+        return np.floor(a).astype(np.int64) if a.dtype.kind == 'f' else a
+
+    def ceil(self, a):
+        a = np.asarray(a)
+        return np.ceil(a).astype(np.int64) if a.dtype.kind == 'f' else a
+
+    def result(self, value):
+        return np.where(self.undefined, np.nan, value)
+
+
+def parameters(D, b, nu):
+    D, b, nu = [np.asarray(p, dtype=np.int64) for p in (D, b, nu)]
+    return D, b, nu, D**3, nu**3, D // nu
+
+
+def creads_cases(x, D, b, nu):
+    """Return the seeks of cases 1 (incomplete columns), 2 (complete columns) and 3 (slices) of Cluster reads."""
+    D, b, nu, R, n, d = parameters(D, b, nu)
+    cases = []
+
+    # case 1: merge only incomplete columns of blocks
+    g = Gnuplot()
+    m = g.div(R*b, n) * g.floor(g.div(x*n, R*b))
+    cases.append(g.result(n + g.ceil(g.div(R*b, nu**2*m)) * D**2))
+
+    # case 2: merge complete columns of blocks
+    g = Gnuplot()
+    m = g.div(R*b, nu**2) * g.floor(g.div(x*nu**2, R*b))
+    cases.append(g.result(n + g.ceil(g.div(R*b, nu*m)) * D))
+
+    # case 3: merge complete slices of blocks
+    g = Gnuplot()
+    m = g.div(R*b, nu) * g.floor(g.div(x*nu, R*b))
+    cases.append(g.result(n + g.ceil(g.div(R*b, m))))
+
+    return cases
+
+
+def creads_bounds(D, b, nu):
+    D, b, nu, R, n, d = parameters(D, b, nu)
+    return (R*b) // nu**2, (R*b) // nu
+
+
+def creads(x, D, b, nu):
+    """Return the number of seeks of Cluster reads with x bytes of memory."""
+    m1, m2 = creads_bounds(D, b, nu)
+    cases = creads_cases(x, D, b, nu)
+    return np.select([x < m1, x < m2], cases[:2], cases[2])
+
+
+def mreads_cases(x, D, b, nu):
+    """Return the seeks of cases 1 to 5 of Multiple reads (voxels, columns, columns of tiles, slices of tiles,
+    slices of blocks)."""
+    D, b, nu, R, n, d = parameters(D, b, nu)
+    cases = []
+
+    # case 1: merge voxels
+    g = Gnuplot()
+    k = g.floor(g.div(x, D*b))
+    cases.append(g.result(g.ceil(g.div(R*b, k*D*b)) * (k + 1) - k + g.mod(nu*D**2, k)))
+
+    # case 2: merge columns
+    g = Gnuplot()
+    k = g.floor(g.div(x, D*b))
+    cases.append(g.result(g.ceil(g.div(R*b, k*D*b)) * (nu + 1)))
+
+    # case 3: merge columns of tiles
+    g = Gnuplot()
+    k = g.floor(g.div(x, D*d*b))
+    cases.append(g.result(g.ceil(g.div(R*b, k*D*d*b)) * (k*nu + 1) - k*nu + nu*g.mod(nu*D, k)))
+
+    # case 4: merge slices of tiles
+    g = Gnuplot()
+    k = g.floor(g.div(x, D*D*b))
+    cases.append(g.result(g.ceil(g.div(R*b, k*D*D*b)) * (nu**2 + 1)))
+
+    # case 5: merge slices of blocks
+    g = Gnuplot()
+    k = g.floor(g.div(x, D**2*d*b))
+    cases.append(g.result(g.ceil(g.div(R*b, k*D**2*d*b)) * (k*nu**2 + 1) - k*nu**2 + nu**2*g.mod(nu, k)))
+
+    return cases
+
+
+def mreads_bounds(D, b, nu):
+    D, b, nu, R, n, d = parameters(D, b, nu)
+    return D*b, D**2 // nu * b, D**2*b, D**3 // nu * b
+
+
+def mreads(x, D, b, nu):
+    """Return the number of seeks of Multiple reads with x bytes of memory."""
+    m3, m4, m5, m6 = mreads_bounds(D, b, nu)
+    cases = mreads_cases(x, D, b, nu)
+    return np.select([x < m3, x < m4, x < m5, x < m6], cases[:4], cases[4])
+
+
+def buffered_slices(x, D, b, nu):
+    """Return the number of seeks of Buffered slices with x bytes of memory."""
+    D, b, nu, R, n, d = parameters(D, b, nu)
+    g = Gnuplot()
+    return g.result(n + g.ceil(g.div(b*R, x)))
+
+
+def naive_blocks(D, b, nu):
+    D, b, nu, R, n, d = parameters(D, b, nu)
+    return n + n*d**2
+
+
+def naive_slices(D, b, nu):
+    D, b, nu, R, n, d = parameters(D, b, nu)
+    return 2*n
+
+
+def fewest_seeks(x, D, b, nu, chunking='blocks'):
+    """Return the algorithm with the fewest seeks at every point of the grid, and its number of seeks.
+
+    chunking is 'blocks' (naive_blocks, clustered, multiple) or 'slices'
+    (naive_slices, buffered_slices). Algorithms are named as in
+    scripts/experiment/benchmark.py.
+    """
+    x = np.asarray(x)
+    shape = np.broadcast(x, D, b, nu).shape
+    if chunking == 'blocks':
+        names = ['naive_blocks', 'clustered', 'multiple']
+        seeks = [naive_blocks(D, b, nu), creads(x, D, b, nu), mreads(x, D, b, nu)]
+    else:
+        names = ['naive_slices', 'buffered_slices']
+        seeks = [naive_slices(D, b, nu), buffered_slices(x, D, b, nu)]
+    seeks = np.array([np.broadcast_to(np.asarray(s, dtype=np.float64), shape) for s in seeks])
+    # undefined values never win
+    best = np.argmin(np.where(np.isnan(seeks), np.inf, seeks), axis=0)
+    return np.array(names)[best], np.choose(best, seeks)
+
+
+def printed_values(D=3458, b=2, nu=5):
+    """Return the 17 values printed by model.gnplt to data/seeks-model.dat."""
+    mems = np.array(printed_mems, dtype=np.int64)
+    return ([naive_blocks(D, b, nu)] + list(creads(mems, D, b, nu)) + list(mreads(mems, D, b, nu)) +
+            [naive_slices(D, b, nu)] + list(buffered_slices(mems, D, b, nu)))
+
+
+def format_value(v):
+    # integers are printed as gnuplot prints them
+    v = float(v)
+    return str(int(v)) if v == int(v) else repr(v)
+
+
+if __name__ == "__main__":
+
+    # sample commands:
+    # python model.py                    (the values of data/seeks-model.dat)
+    # python model.py -D 3458 -b 2 -n 5 -m 1073741824 4294967296
+
+    parser = argparse.ArgumentParser(description='Seek model of the split and merge algorithms')
+    parser.add_argument('-D', '--dim', type=int, default=3458, help="Image dimension, in voxels (the image is D^3)")
+    parser.add_argument('-b', '--bytes-per-voxel', type=int, default=2, help="Bytes per voxel")
+    parser.add_argument('-n', '--nu', type=int, default=5, help="Number of blocks per dimension")
+    parser.add_argument('-m', '--mem', type=int, nargs='+', default=None,
+                        help="Memory values, in bytes: print the seeks of every algorithm for each "
+                             "(default: print the values of data/seeks-model.dat)")
+    args = parser.parse_args()
+
+    if args.mem is None:
+        print(' '.join(format_value(v) for v in printed_values(args.dim, args.bytes_per_voxel, args.nu)))
+    else:
+        mems = np.array(args.mem, dtype=np.int64)
+        D, b, nu = args.dim, args.bytes_per_voxel, args.nu
+        print('mem naive_blocks clustered multiple naive_slices buffered_slices')
+        for mem, cr, mr, bs in zip(mems, creads(mems, D, b, nu), mreads(mems, D, b, nu),
+                                   buffered_slices(mems, D, b, nu)):
+            print(' '.join(format_value(v) if not np.isnan(v) else 'nan'
+                           for v in (mem, naive_blocks(D, b, nu), cr, mr, naive_slices(D, b, nu), bs)))